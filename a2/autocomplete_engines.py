@@ -14,10 +14,21 @@ testing directly! You may, however, add new private attributes, methods, and
 top-level functions to this file.
 """
 from __future__ import annotations
-from typing import Any, Dict, List, Optional, Tuple
+import hashlib
+import os
+import pickle
+import struct
+import sys
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, \
+    Union
 
 from melody import Melody
-from prefix_tree import SimplePrefixTree, CompressedPrefixTree
+from prefix_tree import Autocompleter, SimplePrefixTree, \
+    CompressedPrefixTree, CompiledAutocompleter, AutocompleteSession
+from sanitizer import LETTER_SANITIZER, WORD_SANITIZER
 
 
 ################################################################################
@@ -35,8 +46,11 @@ class LetterAutocompleteEngine:
 
     === Attributes ===
     autocompleter: An Autocompleter used by this engine.
+    result_cache: The cache of the results of autocomplete, or None if
+        results are not cached.
     """
     autocompleter: Autocompleter
+    result_cache: Optional[ResultCache]
 
     def __init__(self, config: Dict[str, Any]) -> None:
         """Initialize this engine with the given configuration.
@@ -47,6 +61,28 @@ class LetterAutocompleteEngine:
               specifying which subclass of Autocompleter to use.
             - 'weight_type': either 'sum' or 'average', which specifies the
               weight type for the prefix tree.
+            - 'cache_size' (optional): the number of top matches each prefix
+              of the prefix tree caches; see the prefix tree initializers.
+              Defaults to 0, which turns caching off.
+            - 'freeze' (optional): if True, the prefix tree is replaced by
+              a read-only CompiledAutocompleter once the file is loaded, so
+              remove may not be called. Defaults to False.
+            - 'cache_dir' (optional): the path to a directory where the
+              built autocompleter is saved, and from which it is loaded
+              instead of reading the file again as long as the file has
+              not changed. With 'freeze', the saved CompiledAutocompleter
+              is used as it is; otherwise the prefix tree is thawed from
+              it node by node, without sorting the values again.
+            - 'workers' (optional): the number of processes that read and
+              sanitize the file at once, each taking one part of it.
+              Defaults to 1, which reads the whole file in this process.
+            - 'result_cache_size' (optional): the number of results of
+              autocomplete kept in self.result_cache, so that a repeated
+              request does not search the autocompleter again. Defaults
+              to 0, which turns the cache off.
+            - 'result_cache_memory' (optional): the most memory, in bytes,
+              used by the results kept in self.result_cache. Defaults to
+              no limit.
 
         Each line of the specified file counts as one input string.
         Note that the line may or may not contain spaces.
@@ -64,21 +100,14 @@ class LetterAutocompleteEngine:
         # We've opened the file for you here. You should iterate over the
         # lines of the file and process them according to the description in
         # this method's docstring.
+        self.result_cache = _result_cache(config)
+        self.autocompleter = _cached_autocompleter(self, config)
+        if self.autocompleter is not None:
+            return
 
-        if config['autocompleter'] == 'simple':
-            self.autocompleter = SimplePrefixTree(config['weight_type'])
-        else:
-            self.autocompleter = CompressedPrefixTree(config['weight_type'])
-
-        with open(config['file'], encoding='utf8') as f:
-            for line in f:
-                line_list = []
-                for char in line:
-                    if char.isalnum() or char == ' ':
-                        line_list.append(char.lower())
-                line_value = ''.join(line_list)
-                if line_value.strip():
-                    self.autocompleter.insert(line_value, 1.0, line_list)
+        stamp = _cache_stamp(config)
+        items = _read_items(config, _letter_items)
+        self.autocompleter = _load_autocompleter(self, config, items, stamp)
 
     def autocomplete(self, prefix: str,
                      limit: Optional[int] = None) -> List[Tuple[str, float]]:
@@ -97,8 +126,51 @@ class LetterAutocompleteEngine:
             <prefix> contains only lowercase alphanumeric characters and spaces
         """
         prefix_list = list(prefix)
+        if self.result_cache is not None:
+            return self.result_cache.lookup(self.autocompleter, prefix_list,
+                                            limit)
         return self.autocompleter.autocomplete(prefix_list, limit)
 
+    def autocomplete_many(self, prefixes: List[str],
+                          limit: Optional[int] = None) -> \
+            List[List[Tuple[str, float]]]:
+        """Return the result of autocomplete(prefix, limit) for each prefix
+        string in <prefixes>, in the same order.
+
+        Preconditions: the preconditions of autocomplete, for each prefix.
+        """
+        return self.autocompleter.autocomplete_many(
+            [list(prefix) for prefix in prefixes], limit)
+
+    def iter_autocomplete(self, prefix: str) -> Iterator[Tuple[str, float]]:
+        """Return an iterator over every match for the given prefix string,
+        in non-increasing order of weight.
+
+        The matches are found as they are taken from the iterator, so a page
+        of matches at a time can be shown without finding the rest. The
+        engine must not change while the iterator is used.
+
+        Precondition: <prefix> contains only lowercase alphanumeric
+        characters and spaces
+        """
+        return self.autocompleter.iter_autocomplete(list(prefix))
+
+    def start_session(self) -> AutocompleteSession:
+        """Return a new AutocompleteSession for this engine's autocompleter,
+        with an empty prefix, for autocompleting a string as it is typed.
+
+        Call session.extend(chars) with the characters typed, and
+        session.backspace(n) to delete the last n of them; session.top(limit)
+        returns what autocomplete would for the string typed so far. Each
+        call only costs as much as the characters added or deleted, plus
+        the matches returned. The engine must not change while the session
+        is used.
+
+        Precondition: the characters passed to extend are lowercase
+        alphanumeric characters and spaces.
+        """
+        return self.autocompleter.start_session()
+
     def remove(self, prefix: str) -> None:
         """Remove all strings that match the given prefix string.
 
@@ -110,6 +182,8 @@ class LetterAutocompleteEngine:
         """
         prefix_list = list(prefix)
         self.autocompleter.remove(prefix_list)
+        if self.result_cache is not None:
+            self.result_cache.discard(prefix_list)
 
 
 class SentenceAutocompleteEngine:
@@ -125,8 +199,11 @@ class SentenceAutocompleteEngine:
 
     === Attributes ===
     autocompleter: An Autocompleter used by this engine.
+    result_cache: The cache of the results of autocomplete, or None if
+        results are not cached.
     """
     autocompleter: Autocompleter
+    result_cache: Optional[ResultCache]
 
     def __init__(self, config: Dict[str, Any]) -> None:
         """Initialize this engine with the given configuration.
@@ -137,6 +214,28 @@ class SentenceAutocompleteEngine:
               specifying which subclass of Autocompleter to use.
             - 'weight_type': either 'sum' or 'average', which specifies the
               weight type for the prefix tree.
+            - 'cache_size' (optional): the number of top matches each prefix
+              of the prefix tree caches; see the prefix tree initializers.
+              Defaults to 0, which turns caching off.
+            - 'freeze' (optional): if True, the prefix tree is replaced by
+              a read-only CompiledAutocompleter once the file is loaded, so
+              remove may not be called. Defaults to False.
+            - 'cache_dir' (optional): the path to a directory where the
+              built autocompleter is saved, and from which it is loaded
+              instead of reading the file again as long as the file has
+              not changed. With 'freeze', the saved CompiledAutocompleter
+              is used as it is; otherwise the prefix tree is thawed from
+              it node by node, without sorting the values again.
+            - 'workers' (optional): the number of processes that read and
+              sanitize the file at once, each taking one part of it.
+              Defaults to 1, which reads the whole file in this process.
+            - 'result_cache_size' (optional): the number of results of
+              autocomplete kept in self.result_cache, so that a repeated
+              request does not search the autocompleter again. Defaults
+              to 0, which turns the cache off.
+            - 'result_cache_memory' (optional): the most memory, in bytes,
+              used by the results kept in self.result_cache. Defaults to
+              no limit.
 
         Precondition:
         The given file is a *CSV file* where each line has two entries:
@@ -158,26 +257,14 @@ class SentenceAutocompleteEngine:
         """
         # We haven't given you any starter code here! You should review how
         # you processed CSV files on Assignment 1.
-        if config['autocompleter'] == 'simple':
-            self.autocompleter = SimplePrefixTree(config['weight_type'])
-        else:
-            self.autocompleter = CompressedPrefixTree(config['weight_type'])
-
-        with open(config['file'], encoding='utf8') as f:
-            for line in f:
-                string, weight = line.split(',')
-                weight = float(weight.strip())
-                # string: 'What time is it?'
-                word_list = string.split()
-                # word_list: ['What', 'time', 'is', 'it?']
-                sanitized_word_list = self.sanitize_word(word_list)
-
-                # sanitized_word_list = ['what', 'time', 'is', 'it']
-                sanitized_value = ' '.join(sanitized_word_list[0])
+        self.result_cache = _result_cache(config)
+        self.autocompleter = _cached_autocompleter(self, config)
+        if self.autocompleter is not None:
+            return
 
-                if sanitized_value.strip():
-                    self.autocompleter.insert(sanitized_value, weight,
-                                              sanitized_word_list[0])
+        stamp = _cache_stamp(config)
+        items = _read_items(config, _sentence_items)
+        self.autocompleter = _load_autocompleter(self, config, items, stamp)
 
     def sanitize_word(self, word_list: List[str]) -> \
             Tuple[List[str], SentenceAutocompleteEngine]:
@@ -187,15 +274,7 @@ class SentenceAutocompleteEngine:
         characters.
         Return the sanitized list and self (to avoid static function).
         """
-        sanitized_word_list = []
-        for word in word_list:
-            char_list = []
-            for char in word:
-                if char.isalnum():
-                    char_list.append(char.lower())
-            sanitized_word = ''.join(char_list)
-            sanitized_word_list.append(sanitized_word)
-        return sanitized_word_list, self
+        return WORD_SANITIZER.sanitize_words(word_list), self
 
     def autocomplete(self, prefix: str,
                      limit: Optional[int] = None) -> List[Tuple[str, float]]:
@@ -214,8 +293,35 @@ class SentenceAutocompleteEngine:
             <prefix> contains only lowercase alphanumeric characters and spaces
         """
         prefix_list = prefix.split()
+        if self.result_cache is not None:
+            return self.result_cache.lookup(self.autocompleter, prefix_list,
+                                            limit)
         return self.autocompleter.autocomplete(prefix_list, limit)
 
+    def autocomplete_many(self, prefixes: List[str],
+                          limit: Optional[int] = None) -> \
+            List[List[Tuple[str, float]]]:
+        """Return the result of autocomplete(prefix, limit) for each prefix
+        string in <prefixes>, in the same order.
+
+        Preconditions: the preconditions of autocomplete, for each prefix.
+        """
+        return self.autocompleter.autocomplete_many(
+            [prefix.split() for prefix in prefixes], limit)
+
+    def iter_autocomplete(self, prefix: str) -> Iterator[Tuple[str, float]]:
+        """Return an iterator over every match for the given prefix string,
+        in non-increasing order of weight.
+
+        The matches are found as they are taken from the iterator, so a page
+        of matches at a time can be shown without finding the rest. The
+        engine must not change while the iterator is used.
+
+        Precondition: <prefix> contains only lowercase alphanumeric
+        characters and spaces
+        """
+        return self.autocompleter.iter_autocomplete(prefix.split())
+
     def remove(self, prefix: str) -> None:
         """Remove all strings that match the given prefix.
 
@@ -227,6 +333,8 @@ class SentenceAutocompleteEngine:
         """
         prefix_list = prefix.split()
         self.autocompleter.remove(prefix_list)
+        if self.result_cache is not None:
+            self.result_cache.discard(prefix_list)
 
 
 ################################################################################
@@ -244,8 +352,11 @@ class MelodyAutocompleteEngine:
 
     # === Private Attributes ===
     autocompleter: An Autocompleter used by this engine.
+    result_cache: The cache of the results of autocomplete, or None if
+        results are not cached.
     """
     autocompleter: Autocompleter
+    result_cache: Optional[ResultCache]
 
     def __init__(self, config: Dict[str, Any]) -> None:
         """Initialize this engine with the given configuration.
@@ -256,6 +367,25 @@ class MelodyAutocompleteEngine:
               specifying which subclass of Autocompleter to use.
             - 'weight_type': either 'sum' or 'average', which specifies the
               weight type for the prefix tree.
+            - 'cache_size' (optional): the number of top matches each prefix
+              of the prefix tree caches; see the prefix tree initializers.
+              Defaults to 0, which turns caching off.
+            - 'freeze' (optional): if True, the prefix tree is replaced by
+              a read-only CompiledAutocompleter once the file is loaded, so
+              remove may not be called. Defaults to False.
+            - 'cache_dir' (optional): the path to a directory where the
+              built autocompleter is saved, and from which it is loaded
+              instead of reading the file again as long as the file has
+              not changed. With 'freeze', the saved CompiledAutocompleter
+              is used as it is; otherwise the prefix tree is thawed from
+              it node by node, without sorting the values again.
+            - 'result_cache_size' (optional): the number of results of
+              autocomplete kept in self.result_cache, so that a repeated
+              request does not search the autocompleter again. Defaults
+              to 0, which turns the cache off.
+            - 'result_cache_memory' (optional): the most memory, in bytes,
+              used by the results kept in self.result_cache. Defaults to
+              no limit.
 
         Precondition:
         The given file is a *CSV file* where each line has the following format:
@@ -272,10 +402,13 @@ class MelodyAutocompleteEngine:
         """
         # We haven't given you any starter code here! You should review how
         # you processed CSV files on Assignment 1.
-        if config['autocompleter'] == 'simple':
-            self.autocompleter = SimplePrefixTree(config['weight_type'])
-        else:
-            self.autocompleter = CompressedPrefixTree(config['weight_type'])
+        self.result_cache = _result_cache(config)
+        self.autocompleter = _cached_autocompleter(self, config)
+        if self.autocompleter is not None:
+            return
+
+        stamp = _cache_stamp(config)
+        items = []
 
         # weight value subtrees
 
@@ -312,7 +445,9 @@ class MelodyAutocompleteEngine:
                         curr_melody = melody.notes[i][0]
                         interval_seq.append(curr_melody - prev_melody)
                         i += 1
-                self.autocompleter.insert(melody, 1.0, interval_seq)
+                items.append((melody, 1.0, interval_seq))
+
+        self.autocompleter = _load_autocompleter(self, config, items, stamp)
 
     def autocomplete(self, prefix: List[int],
                      limit: Optional[int] = None) -> List[Tuple[Melody, float]]:
@@ -326,12 +461,383 @@ class MelodyAutocompleteEngine:
         Precondition:
             limit is None or limit > 0
         """
+        if self.result_cache is not None:
+            return self.result_cache.lookup(self.autocompleter, prefix, limit)
         return self.autocompleter.autocomplete(prefix, limit)
 
+    def autocomplete_many(self, prefixes: List[List[int]],
+                          limit: Optional[int] = None) -> \
+            List[List[Tuple[Melody, float]]]:
+        """Return the result of autocomplete(prefix, limit) for each
+        interval sequence in <prefixes>, in the same order.
+
+        Precondition: limit is None or limit > 0
+        """
+        return self.autocompleter.autocomplete_many(prefixes, limit)
+
+    def iter_autocomplete(self, prefix: List[int]) -> \
+            Iterator[Tuple[Melody, float]]:
+        """Return an iterator over every match for the given interval
+        sequence, in non-increasing order of weight.
+
+        The matches are found as they are taken from the iterator, so a page
+        of matches at a time can be shown without finding the rest. The
+        engine must not change while the iterator is used.
+        """
+        return self.autocompleter.iter_autocomplete(prefix)
+
     def remove(self, prefix: List[int]) -> None:
         """Remove all melodies that match the given interval sequence.
         """
         self.autocompleter.remove(prefix)
+        if self.result_cache is not None:
+            self.result_cache.discard(prefix)
+
+
+################################################################################
+# Result cache
+################################################################################
+class ResultCache:
+    """A cache of the results of the autocomplete method of an
+    Autocompleter, which forgets the least recently used result when it is
+    full.
+
+    === Attributes ===
+    max_size:
+        The most results kept.
+    max_memory:
+        The most memory, in bytes, used by the results kept, or None if
+        there is no limit. This counts the lists and tuples of each result,
+        but not the values in them, which are shared with the
+        Autocompleter.
+    memory:
+        The memory, in bytes, used by the results kept.
+    hits:
+        The number of lookups answered from this cache.
+    misses:
+        The number of lookups that searched the Autocompleter.
+    evictions:
+        The number of results forgotten to keep this cache within its
+        limits.
+    """
+    max_size: int
+    max_memory: Optional[int]
+    memory: int
+    hits: int
+    misses: int
+    evictions: int
+    # === Private Attributes ===
+    # _results maps the prefix, as a tuple, and the limit of each result
+    # kept to that result and the memory it uses, from the least to the most
+    # recently used.
+    _results: OrderedDict
+
+    def __init__(self, max_size: int, max_memory: Optional[int] = None) -> \
+            None:
+        """Initialize an empty cache of at most <max_size> results using at
+        most <max_memory> bytes.
+
+        Precondition: max_size > 0, and max_memory is None or max_memory > 0.
+        """
+        self.max_size = max_size
+        self.max_memory = max_memory
+        self.memory = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._results = OrderedDict()
+
+    def __len__(self) -> int:
+        """Return the number of results kept in this cache."""
+        return len(self._results)
+
+    def lookup(self, autocompleter: Autocompleter, prefix: List,
+               limit: Optional[int]) -> List[Tuple[Any, float]]:
+        """Return autocompleter.autocomplete(prefix, limit), from this cache
+        if it is kept here, and otherwise keeping it.
+
+        Precondition: every result kept in this cache came from
+        <autocompleter>, and it has only changed since through remove calls
+        that were followed by a call to discard.
+        """
+        key = (tuple(prefix), limit)
+        entry = self._results.get(key)
+        if entry is not None:
+            self.hits += 1
+            self._results.move_to_end(key)
+            return list(entry[0])
+
+        self.misses += 1
+        results = autocompleter.autocomplete(prefix, limit)
+        memory = (sys.getsizeof(key) + sys.getsizeof(key[0])
+                  + sys.getsizeof(results)
+                  + sum(sys.getsizeof(match) for match in results))
+        self._results[key] = (list(results), memory)
+        self.memory += memory
+        while (len(self._results) > self.max_size
+               or (self.max_memory is not None
+                   and self.memory > self.max_memory)):
+            self.memory -= self._results.popitem(last=False)[1][1]
+            self.evictions += 1
+        return results
+
+    def discard(self, prefix: List) -> None:
+        """Forget the results that may have changed because the values that
+        match <prefix> were removed from the Autocompleter.
+
+        These are the results for every prefix that starts with <prefix>,
+        and for every prefix that <prefix> starts with.
+        """
+        removed = tuple(prefix)
+        for key in list(self._results):
+            length = min(len(key[0]), len(removed))
+            if key[0][:length] == removed[:length]:
+                self.memory -= self._results.pop(key)[1]
+
+
+################################################################################
+# Helper functions
+################################################################################
+def _result_cache(config: Dict[str, Any]) -> Optional[ResultCache]:
+    """Return a new ResultCache with the limits given by <config>, an engine
+    configuration, or None if it turns the cache off.
+    """
+    if config.get('result_cache_size', 0) <= 0:
+        return None
+    return ResultCache(config['result_cache_size'],
+                       config.get('result_cache_memory'))
+
+
+def _load_autocompleter(engine: Any, config: Dict[str, Any],
+                        items: List[Tuple[Any, float, List]],
+                        stamp: Optional[Dict[str, Any]]) -> Autocompleter:
+    """Return a new Autocompleter of the kind given by <config> that stores
+    the (value, weight, prefix) tuples in <items>, which <engine> read from
+    config['file'].
+
+    <config> is an engine configuration, as described in the engine
+    initializers. If it has a 'cache_dir', the autocompleter is also saved
+    there for _cached_autocompleter, tagged with <stamp>, the _cache_stamp
+    taken before config['file'] was read.
+    """
+    autocompleter = _tree_class(config).bulk_load(
+        items, config['weight_type'], config.get('cache_size', 0))
+    compiled = None
+    if config.get('freeze', False) or 'cache_dir' in config:
+        compiled = autocompleter.freeze()
+    if 'cache_dir' in config:
+        path = _cache_path(engine, config)
+        os.makedirs(config['cache_dir'], exist_ok=True)
+        # Write to a temporary file first, and swap the whole file in at
+        # once, so that another engine loading from the same cache never
+        # sees a partly written file, or a stamp from another file.
+        compiled.save(f'{path}.{os.getpid()}.tmp', stamp)
+        os.replace(f'{path}.{os.getpid()}.tmp', path)
+    if config.get('freeze', False):
+        return compiled
+    return autocompleter
+
+
+def _tree_class(config: Dict[str, Any]) -> type:
+    """Return the prefix tree class given by config['autocompleter']."""
+    if config['autocompleter'] == 'simple':
+        return SimplePrefixTree
+    return CompressedPrefixTree
+
+
+def _read_items(config: Dict[str, Any],
+                read_lines: Callable[[Union[str, bytes]],
+                                     List[Tuple[Any, float, List]]]) -> \
+        List[Tuple[Any, float, List]]:
+    """Return the (value, weight, prefix) tuples that <read_lines> makes from
+    the text of config['file'].
+
+    If config['workers'] is more than 1, the file is split into that many
+    byte ranges, which are read by that many processes at once. Each
+    returns one tuple per distinct value in its range, so that less is sent
+    back to this process. The ranges are passed to <read_lines> as the
+    UTF-8 bytes of the file, so only '\n' ends a line; a lone '\r', which
+    ends a line when the file is read as text, does not.
+    """
+    workers = config.get('workers', 1)
+    if workers <= 1:
+        with open(config['file'], encoding='utf8') as f:
+            return read_lines(f.read())
+
+    size = os.path.getsize(config['file'])
+    bounds = [size * i // workers for i in range(workers + 1)]
+    items = []
+    with ProcessPoolExecutor(workers) as executor:
+        for chunk_items in executor.map(_read_chunk, repeat(read_lines),
+                                        repeat(config['file']), bounds[:-1],
+                                        bounds[1:]):
+            for value, weight, prefix in chunk_items:
+                if prefix is None:
+                    prefix = list(value)
+                items.append((value, weight, prefix))
+    return items
+
+
+def _read_chunk(read_lines: Callable[[Union[str, bytes]],
+                                     List[Tuple[Any, float, List]]],
+                path: str, start: int, end: int) -> \
+        List[Tuple[Any, float, List]]:
+    """Return the (value, weight, prefix) tuples that <read_lines> makes from
+    the bytes of the lines of the file at <path> that start at byte <start>
+    or later, and before byte <end>, with one tuple per distinct value.
+
+    The bytes are not decoded here, so that the letter engine's sanitizer
+    can translate them as they are.
+
+    The prefix of a tuple is None if it is list(value), as for the letter
+    engine, since a list of one-character strings is much slower to send
+    between processes than the string itself.
+    """
+    with open(path, 'rb') as f:
+        if start > 0:
+            # Skip the end of the line that starts before <start>.
+            f.seek(start - 1)
+            f.readline()
+        position = f.tell()
+        text = b''
+        if position < end:
+            # Read on to the end of the line that <end> is in.
+            text = f.read(end - position)
+            if not text.endswith(b'\n'):
+                text += f.readline()
+
+    totals = {}
+    for value, weight, prefix in read_lines(text):
+        if value in totals:
+            totals[value][1] += weight
+        elif prefix == list(value):
+            totals[value] = [value, weight, None]
+        else:
+            totals[value] = [value, weight, prefix]
+    return [tuple(total) for total in totals.values()]
+
+
+def _letter_items(text: Union[str, bytes]) -> \
+        List[Tuple[str, float, List[str]]]:
+    """Return a (value, weight, prefix) tuple for each line of <text>, a
+    string or UTF-8 bytes, that has an alphanumeric character, as described
+    in LetterAutocompleteEngine.
+    """
+    items = []
+    for line_value in LETTER_SANITIZER.sanitize_lines(text):
+        if line_value.strip():
+            items.append((line_value, 1.0, list(line_value)))
+    return items
+
+
+def _sentence_items(text: Union[str, bytes]) -> \
+        List[Tuple[str, float, List[str]]]:
+    """Return a (value, weight, prefix) tuple for each line of <text>, a
+    string or UTF-8 bytes, that has an alphanumeric character, as described
+    in SentenceAutocompleteEngine.
+    """
+    if isinstance(text, bytes):
+        text = text.decode('utf8')
+    items = []
+    lines = text.split('\n')
+    if lines[-1] == '':
+        # The last line ended with a newline.
+        lines.pop()
+    for line in lines:
+        string, weight = line.split(',')
+        weight = float(weight.strip())
+        # string: 'What time is it?'
+        word_list = string.split()
+        # word_list: ['What', 'time', 'is', 'it?']
+        sanitized_word_list = WORD_SANITIZER.sanitize_words(word_list)
+
+        # sanitized_word_list = ['what', 'time', 'is', 'it']
+        sanitized_value = ' '.join(sanitized_word_list)
+
+        if sanitized_value.strip():
+            items.append((sanitized_value, weight, sanitized_word_list))
+    return items
+
+
+def _cached_autocompleter(engine: Any, config: Dict[str, Any]) -> \
+        Optional[Autocompleter]:
+    """Return the autocompleter that <engine> saved in config['cache_dir'] for
+    <config>, or None if there is none or config['file'] has changed since.
+
+    The file has not changed if its size and modification time are the same
+    as when the autocompleter was saved, or else if its contents hash the
+    same.
+
+    The saved CompiledAutocompleter is returned if config['freeze'] is True;
+    otherwise, it is thawed into a prefix tree of the kind given by
+    <config>. None is also returned for a saved autocompleter that cannot be
+    read, or whose contents do not hash as they did when it was saved; it is
+    left for the engine to replace once it has read the file, since another
+    engine may already have replaced it.
+    """
+    if 'cache_dir' not in config:
+        return None
+    path = _cache_path(engine, config)
+    try:
+        stamp = CompiledAutocompleter.load_tag(path)
+        status = os.stat(config['file'])
+        if (status.st_size, status.st_mtime_ns) != (stamp['size'],
+                                                    stamp['mtime_ns']):
+            if _file_hash(config['file']) != stamp['sha256']:
+                return None
+        compiled = CompiledAutocompleter.load(path, check=True)
+    except (OSError, ValueError, KeyError, TypeError, IndexError, EOFError,
+            struct.error, pickle.UnpicklingError):
+        return None
+    if config.get('freeze', False):
+        return compiled
+    return compiled.thaw(_tree_class(config), config.get('cache_size', 0))
+
+
+def _cache_stamp(config: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Return the _file_stamp of config['file'] if <config> has a
+    'cache_dir', or None otherwise.
+
+    The stamp is taken before the file is read, so that if the file is
+    changed while it is read, the saved autocompleter is not used.
+    """
+    if 'cache_dir' not in config:
+        return None
+    return _file_stamp(config['file'])
+
+
+def _cache_path(engine: Any, config: Dict[str, Any]) -> str:
+    """Return the path in config['cache_dir'] of the autocompleter that
+    <engine> builds for <config>.
+
+    The name depends on everything that changes what is built from the
+    file: the engine's class, the file's absolute path, and the
+    'autocompleter' and 'weight_type' of <config>.
+    """
+    file_id = hashlib.sha256(
+        os.path.abspath(config['file']).encode('utf8')).hexdigest()[:16]
+    return os.path.join(config['cache_dir'],
+                        f'{type(engine).__name__}-{config["autocompleter"]}-'
+                        f'{config["weight_type"]}-{file_id}.snapshot')
+
+
+def _file_stamp(path: str) -> Dict[str, Any]:
+    """Return the size, modification time and hash of the file at <path>."""
+    status = os.stat(path)
+    return {
+        'size': status.st_size,
+        'mtime_ns': status.st_mtime_ns,
+        'sha256': _file_hash(path)
+    }
+
+
+def _file_hash(path: str) -> str:
+    """Return the SHA-256 hash of the contents of the file at <path>."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
 
 
 ###############################################################################
@@ -377,11 +883,6 @@ if __name__ == '__main__':
     #     'extra-imports': ['csv', 'prefix_tree', 'melody']
     # })
 
-    # This is used to increase the recursion limit so that your sample runs
-    # work even for fairly tall simple prefix trees.
-    import sys
-    sys.setrecursionlimit(5000)
-
     print(sample_letter_autocomplete())
     print(sample_sentence_autocomplete())
     # sample_melody_autocomplete()
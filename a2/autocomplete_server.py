@@ -0,0 +1,238 @@
+"""CSC148 Assignment 2: Autocomplete server
+
+=== Module description ===
+This file contains an asyncio server that answers autocomplete and remove
+requests for any of the three autocomplete engines, over a Unix socket or a
+TCP socket on this machine. Run it from this directory, for example:
+
+    python autocomplete_server.py --engine sentence \\
+        --file data/google_searches.csv --port 8765
+
+Each request and each response is one line of JSON. A request is an object
+with these keys:
+    - 'op': either 'autocomplete' or 'remove'
+    - 'prefix': the prefix, as given to the engine's method: a string for
+      the letter and sentence engines, or a list of intervals for the
+      melody engine
+    - 'limit' (optional): the limit of an autocomplete request
+    - 'id' (optional): any value, which is copied into the response
+
+The response to an autocomplete request has 'results', a list of
+[value, weight] pairs, where a Melody value is an object with its 'name'
+and 'notes'. The response to a remove request has 'ok'. If a request
+cannot be answered, the response has 'error' instead.
+
+Requests received in the same turn of the event loop are answered
+together, and identical autocomplete requests among them are answered with
+one call to the engine.
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from autocomplete_engines import LetterAutocompleteEngine, \
+    SentenceAutocompleteEngine, MelodyAutocompleteEngine
+from melody import Melody
+
+# The engine class for each value of the --engine argument.
+ENGINES = {
+    'letter': LetterAutocompleteEngine,
+    'sentence': SentenceAutocompleteEngine,
+    'melody': MelodyAutocompleteEngine
+}
+
+
+class AutocompleteServer:
+    """A server for the autocomplete and remove methods of an engine.
+
+    === Attributes ===
+    engine:
+        The autocomplete engine whose methods are served.
+    """
+    engine: Any
+    # === Private Attributes ===
+    # _batch holds the (op, prefix, limit, future) of each request to be
+    # answered in the next batch, in the order they were received.
+    _batch: List[Tuple[str, Any, Optional[int], asyncio.Future]]
+    # _pending maps the prefix and limit of each autocomplete request in
+    # _batch since its last remove request to the future of its result.
+    _pending: Dict[Tuple[Any, Optional[int]], asyncio.Future]
+
+    def __init__(self, engine: Any) -> None:
+        """Initialize a server for <engine>."""
+        self.engine = engine
+        self._batch = []
+        self._pending = {}
+
+    async def serve_tcp(self, host: str, port: int) -> None:
+        """Serve requests on the TCP socket at <host> and <port>, forever.
+        """
+        server = await asyncio.start_server(self._handle_connection, host,
+                                            port)
+        async with server:
+            await server.serve_forever()
+
+    async def serve_unix(self, path: str) -> None:
+        """Serve requests on the Unix socket at <path>, forever."""
+        server = await asyncio.start_unix_server(self._handle_connection,
+                                                 path)
+        async with server:
+            await server.serve_forever()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader,
+                                 writer: asyncio.StreamWriter) -> None:
+        """Answer each request received through <reader> until the client
+        closes the connection.
+
+        Each request is answered as soon as its result is ready, so the
+        responses to requests sent without waiting for earlier responses
+        may be out of order; use 'id' to match them.
+
+        The connection is closed if it is reset, or if a request is longer
+        than the reader's limit of 64 KiB.
+        """
+        tasks: Set[asyncio.Task] = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                task = asyncio.ensure_future(self._answer(line, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                # Stop reading requests while the client is not reading the
+                # responses.
+                await writer.drain()
+        except (ConnectionError, asyncio.LimitOverrunError, ValueError):
+            pass
+        finally:
+            if tasks:
+                await asyncio.wait(tasks)
+            writer.close()
+
+    async def _answer(self, line: bytes,
+                      writer: asyncio.StreamWriter) -> None:
+        """Write to <writer> the response to the request on <line>, and wait
+        until the client has read enough of what was written to <writer>
+        that it can take more.
+        """
+        request = {}
+        try:
+            request = json.loads(line)
+            prefix = request['prefix']
+            if request['op'] == 'autocomplete':
+                results = await self._submit('autocomplete', prefix,
+                                             request.get('limit'))
+                response = {'results': [[_json_value(value), weight]
+                                        for value, weight in results]}
+            elif request['op'] == 'remove':
+                await self._submit('remove', prefix, None)
+                response = {'ok': True}
+            else:
+                raise ValueError(f'unknown op {request["op"]!r}')
+        except Exception as error:
+            response = {'error': f'{type(error).__name__}: {error}'}
+        if isinstance(request, dict) and 'id' in request:
+            response['id'] = request['id']
+        if writer.is_closing():
+            # The connection was reset while the request was answered.
+            return
+        writer.write(json.dumps(response).encode('utf8') + b'\n')
+        try:
+            await writer.drain()
+        except ConnectionError:
+            # The client has gone; _handle_connection closes the writer.
+            pass
+
+    def _submit(self, op: str, prefix: Any,
+                limit: Optional[int]) -> asyncio.Future:
+        """Add a request to the next batch, and return the future of its
+        result.
+
+        An autocomplete request identical to one already in the batch since
+        its last remove request shares that request's future.
+        """
+        loop = asyncio.get_running_loop()
+        if not self._batch:
+            # Answer the batch once every request that is ready to be read
+            # in this turn of the event loop has been added to it.
+            loop.call_soon(self._run_batch)
+        if op == 'remove':
+            self._pending = {}
+        else:
+            key = (tuple(prefix) if isinstance(prefix, list) else prefix,
+                   limit)
+            if key in self._pending:
+                return self._pending[key]
+        future = loop.create_future()
+        self._batch.append((op, prefix, limit, future))
+        if op == 'autocomplete':
+            self._pending[key] = future
+        return future
+
+    def _run_batch(self) -> None:
+        """Call the engine for each request in the batch, in order, and set
+        the result of its future.
+        """
+        batch = self._batch
+        self._batch = []
+        self._pending = {}
+        for op, prefix, limit, future in batch:
+            try:
+                if op == 'autocomplete':
+                    future.set_result(self.engine.autocomplete(prefix, limit))
+                else:
+                    self.engine.remove(prefix)
+                    future.set_result(None)
+            except Exception as error:
+                future.set_exception(error)
+
+
+def _json_value(value: Any) -> Any:
+    """Return <value>, a value stored in an engine, in a form that can be
+    written as JSON.
+    """
+    if isinstance(value, Melody):
+        return {'name': value.name,
+                'notes': [list(note) for note in value.notes]}
+    return value
+
+
+def main(arguments: Optional[List[str]] = None) -> None:
+    """Start a server for the engine described by the command-line
+    <arguments>, or by sys.argv if <arguments> is None.
+    """
+    parser = argparse.ArgumentParser(
+        description='Serve an autocomplete engine over a local socket.')
+    parser.add_argument('--engine', choices=sorted(ENGINES), required=True)
+    parser.add_argument('--file', required=True)
+    parser.add_argument('--autocompleter', choices=['simple', 'compressed'],
+                        default='compressed')
+    parser.add_argument('--weight-type', choices=['sum', 'average'],
+                        default='sum')
+    parser.add_argument('--cache-dir',
+                        help="the engine's 'cache_dir' config key")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--unix', metavar='PATH',
+                        help='serve on this Unix socket instead of TCP')
+    args = parser.parse_args(arguments)
+
+    config = {
+        'file': args.file,
+        'autocompleter': args.autocompleter,
+        'weight_type': args.weight_type
+    }
+    if args.cache_dir is not None:
+        config['cache_dir'] = args.cache_dir
+    server = AutocompleteServer(ENGINES[args.engine](config))
+    if args.unix is not None:
+        asyncio.run(server.serve_unix(args.unix))
+    else:
+        asyncio.run(server.serve_tcp(args.host, args.port))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,782 @@
+"""CSC148 Assignment 2: Benchmarks
+
+=== Module description ===
+This file contains timing benchmarks for the autocomplete engines, run on the
+data files bundled in data/. Run it from this directory:
+
+    python benchmarks.py
+
+Each benchmark prints one line per configuration, so that the output from
+two versions of the code can be compared line by line.
+"""
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from itertools import islice
+from typing import Any, Callable, List, Tuple
+
+from autocomplete_engines import LetterAutocompleteEngine, \
+    SentenceAutocompleteEngine, MelodyAutocompleteEngine, _letter_items, \
+    _sentence_items
+from prefix_tree import SimplePrefixTree, CompressedPrefixTree, \
+    CompiledAutocompleter, ShardedAutocompleter
+from sanitizer import LETTER_SANITIZER, WORD_SANITIZER
+
+# Each bundled data file, with the engine that reads it.
+DATA_FILES: List[Tuple[Any, str]] = [
+    (LetterAutocompleteEngine, 'data/lotr.txt'),
+    (LetterAutocompleteEngine, 'data/google_no_swears.txt'),
+    (SentenceAutocompleteEngine, 'data/google_searches.csv'),
+    (MelodyAutocompleteEngine, 'data/random_melodies_c_scale.csv'),
+    (MelodyAutocompleteEngine, 'data/songbook.csv'),
+]
+
+
+def best_time(func: Callable[[], Any], repeat: int = 3) -> float:
+    """Return the shortest of <repeat> wall-clock timings of func(), in
+    seconds.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def benchmark_load() -> None:
+    """Print the time taken to build each engine from each bundled data file.
+    """
+    print('=== Load time ===')
+    for engine, file in DATA_FILES:
+        for autocompleter in ['simple', 'compressed']:
+            for weight_type in ['sum', 'average']:
+                config = {
+                    'file': file,
+                    'autocompleter': autocompleter,
+                    'weight_type': weight_type
+                }
+                seconds = best_time(lambda: engine(config))
+                print(f'{file:35} {autocompleter:10} {weight_type:7} '
+                      f'{seconds:8.3f}s')
+
+
+def benchmark_autocomplete(limit: int = 10) -> None:
+    """Print the average time of one letter engine query with the given limit.
+
+    The queries are the one to three letter prefixes of the engine's 200
+    heaviest strings, which are the prefixes with the most completions.
+    """
+    print(f'=== Autocomplete time (limit={limit}) ===')
+    for file in ['data/lotr.txt', 'data/google_no_swears.txt']:
+        for autocompleter in ['simple', 'compressed']:
+            engine = LetterAutocompleteEngine({
+                'file': file,
+                'autocompleter': autocompleter,
+                'weight_type': 'sum'
+            })
+            prefixes = [''.join(prefix)
+                        for prefix in _query_prefixes(engine.autocompleter)]
+
+            def run_queries() -> None:
+                """Run every query once."""
+                for prefix in prefixes:
+                    engine.autocomplete(prefix, limit)
+
+            seconds = best_time(run_queries)
+            print(f'{file:35} {autocompleter:10} '
+                  f'{seconds / len(prefixes) * 1e6:10.1f}us/query')
+
+
+def benchmark_latency(limit: int = 10, rounds: int = 100) -> None:
+    """Print the median and 99th percentile latency of one letter engine
+    query for each one-letter prefix, with and without the prefix tree cache.
+    """
+    print(f'=== One-letter prefix latency (limit={limit}) ===')
+    file = 'data/google_no_swears.txt'
+    prefixes = list('abcdefghijklmnopqrstuvwxyz0123456789') * rounds
+    for autocompleter in ['simple', 'compressed']:
+        for cache_size in [0, limit]:
+            engine = LetterAutocompleteEngine({
+                'file': file,
+                'autocompleter': autocompleter,
+                'weight_type': 'sum',
+                'cache_size': cache_size
+            })
+            latencies = []
+            for prefix in prefixes:
+                start = time.perf_counter()
+                engine.autocomplete(prefix, limit)
+                latencies.append(time.perf_counter() - start)
+            latencies.sort()
+            p50 = latencies[len(latencies) // 2] * 1e6
+            p99 = latencies[len(latencies) * 99 // 100] * 1e6
+            print(f'{file:35} {autocompleter:10} cache_size={cache_size:<3} '
+                  f'p50 {p50:8.1f}us  p99 {p99:8.1f}us')
+
+
+def benchmark_long_keys(num_keys: int = 200, length: int = 1000) -> None:
+    """Print insert and autocomplete throughput for <num_keys> random keys of
+    <length> letters each.
+
+    Each query asks for the top 10 matches of the first half of a key.
+    """
+    print(f'=== {length}-element keys ===')
+    rng = random.Random(148)
+    keys = [''.join(rng.choice('abcd') for _ in range(length))
+            for _ in range(num_keys)]
+    for tree_class in [SimplePrefixTree, CompressedPrefixTree]:
+        tree = tree_class('sum')
+        start = time.perf_counter()
+        for key in keys:
+            tree.insert(key, 1.0, list(key))
+        insert_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for key in keys:
+            tree.autocomplete(list(key[:length // 2]), 10)
+        query_seconds = time.perf_counter() - start
+        print(f'{tree_class.__name__:21} '
+              f'{num_keys / insert_seconds:10.1f} inserts/s '
+              f'{num_keys / query_seconds:10.1f} queries/s')
+
+
+def benchmark_memory() -> None:
+    """Print the memory held by each engine's prefix tree after it is built
+    from each bundled data file, per value stored in the tree.
+
+    Memory is measured with tracemalloc, as the memory allocated while the
+    engine is built that is still in use afterwards.
+    """
+    print('=== Memory ===')
+    for engine, file in DATA_FILES:
+        for autocompleter in ['simple', 'compressed']:
+            config = {
+                'file': file,
+                'autocompleter': autocompleter,
+                'weight_type': 'sum'
+            }
+            tracemalloc.start()
+            before = tracemalloc.get_traced_memory()[0]
+            tree = engine(config).autocompleter
+            used = tracemalloc.get_traced_memory()[0] - before
+            tracemalloc.stop()
+            print(f'{file:35} {autocompleter:10} {used / 1e6:8.1f}MB '
+                  f'{used / len(tree):10.0f}B/key')
+
+
+def benchmark_compiled(limit: int = 10) -> None:
+    """Print the memory used and the average query time of each letter
+    engine's prefix tree, and of the CompiledAutocompleter frozen from it.
+
+    The queries are those of benchmark_autocomplete. The memory of the
+    compiled autocompleter does not count the values, which it shares with
+    the tree it was frozen from.
+    """
+    print(f'=== Compiled autocompleter (limit={limit}) ===')
+    for file in ['data/lotr.txt', 'data/google_no_swears.txt']:
+        for autocompleter in ['simple', 'compressed']:
+            tracemalloc.start()
+            tree = LetterAutocompleteEngine({
+                'file': file,
+                'autocompleter': autocompleter,
+                'weight_type': 'sum'
+            }).autocompleter
+            tree_memory = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            tracemalloc.start()
+            compiled = tree.freeze()
+            compiled_memory = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+
+            prefixes = _query_prefixes(tree)
+            for name, completer, memory in [(autocompleter, tree,
+                                             tree_memory),
+                                            ('compiled', compiled,
+                                             compiled_memory)]:
+                seconds = best_time(
+                    lambda: [completer.autocomplete(prefix, limit)
+                             for prefix in prefixes])
+                print(f'{file:35} {name:10} {memory / 1e6:8.1f}MB '
+                      f'{seconds / len(prefixes) * 1e6:10.1f}us/query')
+
+
+def benchmark_sanitize() -> None:
+    """Print the throughput of sanitizing each text engine data file, one
+    character at a time in Python and with the Sanitizers of sanitizer.py.
+
+    The file is read before the timing starts.
+    """
+    print('=== Sanitization throughput ===')
+    with open('data/lotr.txt', encoding='utf8') as f:
+        text = f.read()
+
+    def sanitize_letters_by_char() -> None:
+        """Sanitize each line of text one character at a time."""
+        for line in text.split('\n'):
+            line_list = []
+            for char in line:
+                if char.isalnum() or char == ' ':
+                    line_list.append(char.lower())
+            ''.join(line_list)
+
+    _print_throughput('data/lotr.txt', len(text.encode('utf8')), [
+        ('by character', sanitize_letters_by_char),
+        ('sanitizer', lambda: LETTER_SANITIZER.sanitize_lines(text))])
+
+    with open('data/google_searches.csv', encoding='utf8') as f:
+        strings = [line.split(',')[0] for line in f]
+
+    def sanitize_words_by_char() -> None:
+        """Sanitize each word of each string one character at a time."""
+        for string in strings:
+            for word in string.split():
+                char_list = []
+                for char in word:
+                    if char.isalnum():
+                        char_list.append(char.lower())
+                ''.join(char_list)
+
+    def sanitize_words() -> None:
+        """Sanitize each word of each string with WORD_SANITIZER."""
+        for string in strings:
+            WORD_SANITIZER.sanitize_words(string.split())
+
+    _print_throughput('data/google_searches.csv',
+                      sum(len(string.encode('utf8')) for string in strings),
+                      [('by character', sanitize_words_by_char),
+                       ('sanitizer', sanitize_words)])
+
+
+def _print_throughput(file: str, size: int,
+                      funcs: List[Tuple[str, Callable[[], Any]]]) -> None:
+    """Print the throughput of each named function in <funcs>, which each
+    process <size> bytes of <file>.
+    """
+    for name, func in funcs:
+        seconds = best_time(func)
+        print(f'{file:35} {name:12} {size / seconds / 1e6:10.1f}MB/s')
+
+
+def benchmark_bulk_load() -> None:
+    """Print the time taken to build a prefix tree from the strings of each
+    letter engine data file by inserting them one at a time, and by
+    bulk_load.
+
+    The strings are read and sanitized as the letter engine does it, before
+    the timing starts.
+    """
+    print('=== Bulk load time ===')
+    for file in ['data/lotr.txt', 'data/google_no_swears.txt']:
+        items = _letter_file_items(file)
+
+        for tree_class in [SimplePrefixTree, CompressedPrefixTree]:
+            def insert_all() -> None:
+                """Insert every item into a new tree, one at a time."""
+                tree = tree_class('sum')
+                for value, weight, prefix in items:
+                    tree.insert(value, weight, prefix)
+
+            insert_seconds = best_time(insert_all)
+            bulk_seconds = best_time(
+                lambda: tree_class.bulk_load(items, 'sum'))
+            print(f'{file:35} {tree_class.__name__:21} '
+                  f'insert {insert_seconds:8.3f}s  '
+                  f'bulk_load {bulk_seconds:8.3f}s')
+
+
+def _letter_file_items(file: str) -> List[Tuple[str, float, List[str]]]:
+    """Return the (value, weight, prefix) tuples that the letter engine reads
+    from <file>.
+    """
+    with open(file, encoding='utf8') as f:
+        return _letter_items(f.read())
+
+
+def _query_prefixes(autocompleter: Any) -> List[List]:
+    """Return the one to three element prefixes of the values of the 200
+    heaviest leaves of <autocompleter>, which are the prefixes with the most
+    completions, in sorted order.
+
+    Precondition: the values stored in <autocompleter> are sequences.
+    """
+    prefixes = {tuple(value[:length])
+                for value, _ in autocompleter.autocomplete([], 200)
+                for length in [1, 2, 3]}
+    return [list(prefix) for prefix in sorted(prefixes)]
+
+
+def benchmark_merge(parts: int = 4) -> None:
+    """Print the time taken to combine prefix trees built from <parts>
+    interleaved parts of the strings of each letter engine data file into
+    the tree of the first part, by inserting the strings of the other parts
+    one at a time, and by merge.
+
+    The trees of the parts are built before the timing starts.
+    """
+    print(f'=== Merge time ({parts} parts) ===')
+    for file in ['data/lotr.txt', 'data/google_no_swears.txt']:
+        items = _letter_file_items(file)
+        part_items = [items[i::parts] for i in range(parts)]
+
+        for tree_class in [SimplePrefixTree, CompressedPrefixTree]:
+            others = [tree_class.bulk_load(part, 'sum')
+                      for part in part_items[1:]]
+            insert_times = []
+            merge_times = []
+            for _ in range(3):
+                tree = tree_class.bulk_load(part_items[0], 'sum')
+                start = time.perf_counter()
+                for part in part_items[1:]:
+                    for value, weight, prefix in part:
+                        tree.insert(value, weight, prefix)
+                insert_times.append(time.perf_counter() - start)
+
+                tree = tree_class.bulk_load(part_items[0], 'sum')
+                start = time.perf_counter()
+                for other in others:
+                    tree.merge(other)
+                merge_times.append(time.perf_counter() - start)
+            print(f'{file:35} {tree_class.__name__:21} '
+                  f'insert {min(insert_times):8.3f}s  '
+                  f'merge {min(merge_times):8.3f}s')
+
+
+def benchmark_workers(counts: Tuple[int, ...] = (1, 2, 4)) -> None:
+    """Print the time taken to build each text engine from each of its
+    bundled data files, reading the file with each number of worker
+    processes in <counts>.
+    """
+    print('=== Load time by workers ===')
+    for engine, file in DATA_FILES:
+        if engine is MelodyAutocompleteEngine:
+            continue
+        for workers in counts:
+            config = {
+                'file': file,
+                'autocompleter': 'compressed',
+                'weight_type': 'sum',
+                'workers': workers
+            }
+            seconds = best_time(lambda: engine(config))
+            print(f'{file:35} {workers:2} workers {seconds:8.3f}s')
+
+
+def benchmark_sharded(limit: int = 10, shard_count: int = 4) -> None:
+    """Print the load time and the average query time of a
+    CompressedPrefixTree built from the strings of each letter engine data
+    file, and of ShardedAutocompleters with <shard_count> shards in this
+    process and in worker processes.
+
+    The queries are those of benchmark_autocomplete, whose prefixes of one
+    element are sent to every shard.
+    """
+    print(f'=== Sharded autocompleter ({shard_count} shards, '
+          f'limit={limit}) ===')
+    for file in ['data/lotr.txt', 'data/google_no_swears.txt']:
+        items = _letter_file_items(file)
+
+        for name, build in [
+                ('tree', lambda: CompressedPrefixTree.bulk_load(items, 'sum')),
+                ('sharded', lambda: ShardedAutocompleter.bulk_load(
+                    items, 'sum', shard_count=shard_count, key_length=2)),
+                ('processes', lambda: ShardedAutocompleter.bulk_load(
+                    items, 'sum', shard_count=shard_count, key_length=2,
+                    processes=True))]:
+            start = time.perf_counter()
+            completer = build()
+            # Wait for worker processes to finish building their shards.
+            len(completer)
+            load_seconds = time.perf_counter() - start
+
+            prefixes = _query_prefixes(completer)
+            seconds = best_time(
+                lambda: [completer.autocomplete(prefix, limit)
+                         for prefix in prefixes])
+            if isinstance(completer, ShardedAutocompleter):
+                completer.close()
+            print(f'{file:35} {name:10} load {load_seconds:8.3f}s '
+                  f'{seconds / len(prefixes) * 1e6:10.1f}us/query')
+
+
+def benchmark_autocomplete_many(limit: int = 10,
+                                batch_size: int = 10000) -> None:
+    """Print the time taken to answer a batch of <batch_size> prefixes from
+    data/google_searches.csv with one autocomplete call per prefix, and with
+    one autocomplete_many call.
+
+    The strings are read and sanitized as the sentence engine does it. The
+    sentence engine is given the word prefixes of each string, and the
+    letter engine for data/google_no_swears.txt its letter prefixes, in the
+    order of the file, starting again at the top of the file as needed.
+    """
+    print(f'=== Batch autocomplete ({batch_size} prefixes, '
+          f'limit={limit}) ===')
+    with open('data/google_searches.csv', encoding='utf8') as f:
+        items = _sentence_items(f.read())
+    word_prefixes = [' '.join(prefix[:length]) for _, _, prefix in items
+                     for length in range(1, len(prefix) + 1)]
+    letter_prefixes = [value[:length] for value, _, _ in items
+                       for length in range(1, len(value) + 1)]
+
+    for engine, file, prefixes in [
+            (SentenceAutocompleteEngine, 'data/google_searches.csv',
+             word_prefixes),
+            (LetterAutocompleteEngine, 'data/google_no_swears.txt',
+             letter_prefixes)]:
+        batch = [prefixes[i % len(prefixes)] for i in range(batch_size)]
+        for autocompleter in ['simple', 'compressed']:
+            completer = engine({
+                'file': file,
+                'autocompleter': autocompleter,
+                'weight_type': 'sum'
+            })
+            one_seconds = best_time(
+                lambda: [completer.autocomplete(prefix, limit)
+                         for prefix in batch])
+            many_seconds = best_time(
+                lambda: completer.autocomplete_many(batch, limit))
+            print(f'{file:35} {autocompleter:10} '
+                  f'autocomplete {one_seconds:8.3f}s  '
+                  f'autocomplete_many {many_seconds:8.3f}s')
+
+
+def benchmark_result_cache(limit: int = 10, queries: int = 20000,
+                           cache_size: int = 1000) -> None:
+    """Print the average time of one letter engine query with the given
+    limit, with and without a result cache of <cache_size> results, and the
+    share of queries answered from the cache.
+
+    The <queries> queries are drawn from the one to five letter prefixes of
+    the engine's 2000 heaviest strings, the i-th most common of them with
+    weight 1 / i, so that a few prefixes make up most of the traffic.
+    """
+    print(f'=== Result cache (limit={limit}, cache_size={cache_size}) ===')
+    rng = random.Random(148)
+    for file in ['data/lotr.txt', 'data/google_no_swears.txt']:
+        config = {
+            'file': file,
+            'autocompleter': 'compressed',
+            'weight_type': 'sum'
+        }
+        engine = LetterAutocompleteEngine(config)
+        prefixes = sorted({value[:length]
+                           for value, _ in engine.autocomplete('', 2000)
+                           for length in range(1, 6)})
+        rng.shuffle(prefixes)
+        batch = rng.choices(prefixes, [1 / rank for rank in
+                                       range(1, len(prefixes) + 1)],
+                            k=queries)
+
+        for name, engine in [
+                ('uncached', engine),
+                ('cached', LetterAutocompleteEngine(
+                    dict(config, result_cache_size=cache_size)))]:
+            seconds = best_time(
+                lambda: [engine.autocomplete(prefix, limit)
+                         for prefix in batch])
+            line = (f'{file:35} {name:10} '
+                    f'{seconds / queries * 1e6:10.1f}us/query')
+            if engine.result_cache is not None:
+                cache = engine.result_cache
+                line += (f'  hit rate '
+                         f'{cache.hits / (cache.hits + cache.misses):6.1%}')
+            print(line)
+
+
+def benchmark_session(limit: int = 10, length: int = 30) -> None:
+    """Print the average time of one keystroke when typing the first
+    <length> letters of each of a letter engine's 200 heaviest strings, and
+    asking for <limit> matches after each, by calling autocomplete with the
+    string typed so far and by using a session.
+    """
+    print(f'=== Keystroke time (limit={limit}) ===')
+    for file in ['data/lotr.txt', 'data/google_no_swears.txt']:
+        for autocompleter in ['simple', 'compressed']:
+            engine = LetterAutocompleteEngine({
+                'file': file,
+                'autocompleter': autocompleter,
+                'weight_type': 'sum'
+            })
+            strings = [value[:length]
+                       for value, _ in engine.autocomplete('', 200)]
+            keystrokes = sum(len(string) for string in strings)
+
+            def type_strings() -> None:
+                """Type each string, calling autocomplete every keystroke.
+                """
+                for string in strings:
+                    for i in range(1, len(string) + 1):
+                        engine.autocomplete(string[:i], limit)
+
+            def type_strings_in_session() -> None:
+                """Type each string in a session."""
+                session = engine.start_session()
+                for string in strings:
+                    for char in string:
+                        session.extend(char)
+                        session.top(limit)
+                    session.backspace(len(string))
+
+            for name, func in [('autocomplete', type_strings),
+                               ('session', type_strings_in_session)]:
+                seconds = best_time(func)
+                print(f'{file:35} {autocompleter:10} {name:12} '
+                      f'{seconds / keystrokes * 1e6:10.1f}us/keystroke')
+
+
+def benchmark_iter_autocomplete(page: int = 10, pages: int = 5) -> None:
+    """Print the average time to show <pages> pages of <page> matches for
+    each one-letter prefix of a letter engine: by taking every match, by
+    calling autocomplete with a larger limit for each page, and by taking
+    each page from iter_autocomplete.
+    """
+    print(f'=== Pagination time ({pages} pages of {page}) ===')
+    for autocompleter in ['simple', 'compressed']:
+        engine = LetterAutocompleteEngine({
+            'file': 'data/lotr.txt',
+            'autocompleter': autocompleter,
+            'weight_type': 'sum'
+        })
+        prefixes = sorted({value[0] for value, _ in engine.autocomplete('')})
+
+        def take_every_match() -> None:
+            """Find every match, and show the pages from it."""
+            for prefix in prefixes:
+                matches = engine.autocomplete(prefix)
+                for i in range(pages):
+                    matches[i * page:(i + 1) * page]
+
+        def take_larger_limits() -> None:
+            """Call autocomplete with a larger limit for each page."""
+            for prefix in prefixes:
+                for i in range(pages):
+                    engine.autocomplete(prefix, (i + 1) * page)[i * page:]
+
+        def take_from_iterator() -> None:
+            """Take each page from one iterator."""
+            for prefix in prefixes:
+                matches = engine.iter_autocomplete(prefix)
+                for _ in range(pages):
+                    list(islice(matches, page))
+
+        for name, func in [('every match', take_every_match),
+                           ('larger limits', take_larger_limits),
+                           ('iterator', take_from_iterator)]:
+            seconds = best_time(func)
+            print(f'data/lotr.txt {autocompleter:10} {name:14} '
+                  f'{seconds / len(prefixes) * 1e3:10.3f}ms/prefix')
+
+
+def benchmark_query_allocations(limit: int = 10) -> None:
+    """Print the average memory allocated by one compressed letter engine
+    query, as measured by tracemalloc.
+
+    'peak' is the most memory in use at once during the query, and 'kept' is
+    the memory still in use after it, which is the returned list. The queries
+    are those of benchmark_autocomplete.
+
+    Each file is also loaded into a second tree holding only the strings that
+    start with the most common first letter, so that its root has a
+    non-empty value.
+    """
+    print(f'=== Compressed query allocations (limit={limit}) ===')
+    for file in ['data/lotr.txt', 'data/google_no_swears.txt']:
+        tree = LetterAutocompleteEngine({
+            'file': file,
+            'autocompleter': 'compressed',
+            'weight_type': 'sum'
+        }).autocompleter
+        queries = _query_prefixes(tree)
+        _print_query_allocations(file, tree, queries, limit)
+
+        letter = tree.autocomplete([], 1)[0][0][0]
+        letter_tree = CompressedPrefixTree.bulk_load(
+            [(value, weight, list(value))
+             for value, weight in tree.autocomplete([letter])], 'sum')
+        _print_query_allocations(
+            f'{file} ({letter!r} only)', letter_tree,
+            [query for query in queries if query[0] == letter], limit)
+
+
+def _print_query_allocations(name: str, tree: Any, queries: List[List],
+                             limit: int) -> None:
+    """Print the average memory allocated by one query of <tree> for each
+    prefix in <queries>, as described in benchmark_query_allocations.
+    """
+    peak_total = 0
+    kept_total = 0
+    tracemalloc.start()
+    for prefix in queries:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        result = tree.autocomplete(prefix, limit)
+        current, peak = tracemalloc.get_traced_memory()
+        peak_total += peak - before
+        kept_total += current - before
+        del result
+    tracemalloc.stop()
+    print(f'{name:40} peak {peak_total / len(queries):8.0f}B/query  '
+          f'kept {kept_total / len(queries):8.0f}B/query')
+
+
+def benchmark_scaled_sentences(scales: Tuple[int, ...] = (1, 10, 50)) -> None:
+    """Print the insert and query throughput of each prefix tree for the
+    sentence engine data, scaled up synthetically.
+
+    For each scale s, s times as many sentences as data/google_searches.csv
+    holds are made by picking two to six words at random from the words in
+    that file. So each tree in the prefix tree has up to as many subtrees as
+    there are distinct words. Each query asks for the top 10 matches of the
+    first word of a sentence.
+    """
+    print('=== Scaled google_searches.csv sentences ===')
+    with open('data/google_searches.csv', encoding='utf8') as f:
+        items = _sentence_items(f.read())
+    words = sorted({word for _, _, prefix in items for word in prefix if word})
+
+    rng = random.Random(148)
+    for scale in scales:
+        sentences = [[rng.choice(words) for _ in range(rng.randint(2, 6))]
+                     for _ in range(scale * len(items))]
+        for tree_class in [SimplePrefixTree, CompressedPrefixTree]:
+            tree = tree_class('sum')
+            start = time.perf_counter()
+            for sentence in sentences:
+                tree.insert(' '.join(sentence), 1.0, sentence)
+            insert_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            for sentence in sentences[:1000]:
+                tree.autocomplete(sentence[:1], 10)
+            query_seconds = time.perf_counter() - start
+            print(f'x{scale:<3} {len(sentences):7} sentences '
+                  f'{tree_class.__name__:21} '
+                  f'{len(sentences) / insert_seconds:10.0f} inserts/s '
+                  f'{min(1000, len(sentences)) / query_seconds:10.0f} '
+                  f'queries/s')
+
+
+def benchmark_snapshot(limit: int = 10) -> None:
+    """Print the cold start time of each letter engine: the time taken to
+    build its prefix tree from the data file, and to load a snapshot of it
+    saved with save, each followed by its first query.
+
+    Also print the size of the snapshot file and the average query time of
+    the loaded autocompleter, with the queries of benchmark_autocomplete.
+    """
+    print(f'=== Snapshot cold start (limit={limit}) ===')
+    for file in ['data/lotr.txt', 'data/google_no_swears.txt']:
+        for autocompleter in ['simple', 'compressed']:
+            config = {
+                'file': file,
+                'autocompleter': autocompleter,
+                'weight_type': 'sum'
+            }
+            start = time.perf_counter()
+            tree = LetterAutocompleteEngine(config).autocompleter
+            tree.autocomplete([], limit)
+            build_seconds = time.perf_counter() - start
+
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, 'snapshot')
+                tree.save(path)
+                size = os.path.getsize(path)
+                start = time.perf_counter()
+                loaded = CompiledAutocompleter.load(path)
+                loaded.autocomplete([], limit)
+                load_seconds = time.perf_counter() - start
+
+                prefixes = _query_prefixes(tree)
+                seconds = best_time(
+                    lambda: [loaded.autocomplete(prefix, limit)
+                             for prefix in prefixes])
+            print(f'{file:35} {autocompleter:10} build {build_seconds:8.3f}s '
+                  f'load {load_seconds * 1e3:8.2f}ms {size / 1e6:7.1f}MB '
+                  f'{seconds / len(prefixes) * 1e6:10.1f}us/query')
+
+
+def benchmark_import_time(module: str = 'autocomplete_engines',
+                          rounds: int = 5) -> None:
+    """Print the best time, over <rounds> new processes, taken to import
+    <module> and the modules it imports, as reported by python -X importtime.
+
+    Besides <module>, the lines are for melody and the pygame and mido
+    modules it uses, if they were imported.
+    """
+    print(f'=== Import time of {module} ===')
+    names = [module, 'melody', 'pygame', 'mido']
+    best = {}
+    for _ in range(rounds):
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+            capture_output=True, text=True, check=True)
+        for line in result.stderr.splitlines():
+            # Each line is 'import time: <self> | <cumulative> | <name>',
+            # in microseconds.
+            fields = line.split('|')
+            name = fields[-1].strip()
+            if line.startswith('import time:') and name in names:
+                microseconds = int(fields[1])
+                best[name] = min(best.get(name, microseconds), microseconds)
+    for name in names:
+        if name in best:
+            print(f'{name:35} {best[name] / 1e3:10.1f}ms')
+        else:
+            print(f'{name:35} {"not imported":>12}')
+
+
+def benchmark_cache_start() -> None:
+    """Print the time taken to build each letter engine with no 'cache_dir',
+    and with a 'cache_dir' that is empty (cold) and that holds the engine
+    saved by the cold start (warm), with and without 'freeze'.
+    """
+    print('=== Cache start ===')
+    for file in ['data/lotr.txt', 'data/google_no_swears.txt']:
+        for autocompleter in ['simple', 'compressed']:
+            for freeze in [False, True]:
+                config = {
+                    'file': file,
+                    'autocompleter': autocompleter,
+                    'weight_type': 'sum',
+                    'freeze': freeze
+                }
+                seconds = best_time(lambda: LetterAutocompleteEngine(config),
+                                    1)
+                with tempfile.TemporaryDirectory() as directory:
+                    cached = dict(config, cache_dir=directory)
+                    cold_seconds = best_time(
+                        lambda: LetterAutocompleteEngine(cached), 1)
+                    warm_seconds = best_time(
+                        lambda: LetterAutocompleteEngine(cached))
+                print(f'{file:35} {autocompleter:10} '
+                      f'{"freeze" if freeze else "tree":6} '
+                      f'no cache {seconds:8.3f}s cold {cold_seconds:8.3f}s '
+                      f'warm {warm_seconds:8.3f}s')
+
+
+if __name__ == '__main__':
+    benchmark_load()
+    benchmark_autocomplete()
+    benchmark_latency()
+    benchmark_long_keys()
+    benchmark_memory()
+    benchmark_compiled()
+    benchmark_sanitize()
+    benchmark_bulk_load()
+    benchmark_merge()
+    benchmark_workers()
+    benchmark_sharded()
+    benchmark_autocomplete_many()
+    benchmark_result_cache()
+    benchmark_session()
+    benchmark_iter_autocomplete()
+    benchmark_query_allocations()
+    benchmark_scaled_sentences()
+    benchmark_snapshot()
+    benchmark_import_time()
+    benchmark_cache_start()
@@ -0,0 +1,128 @@
+"""CSC148 Assignment 2: Load generator for the autocomplete server
+
+=== Module description ===
+This file sends autocomplete requests to a running autocomplete_server.py
+and reports its throughput and latency. The prefixes are those of the
+strings in data/google_searches.csv, sanitized as the sentence engine does
+it, and are sent in the order of the file, starting again at the top of the
+file as needed. Start a sentence engine server, then run this script from
+this directory:
+
+    python autocomplete_server.py --engine sentence \\
+        --file data/google_searches.csv --port 8765
+    python load_generator.py --port 8765
+
+With --letters, the prefixes are the letter prefixes of the strings
+instead, for a letter engine server.
+
+Each connection sends one request at a time and waits for its response, so
+the number of connections is the number of requests in flight.
+"""
+import argparse
+import asyncio
+import json
+import time
+from typing import Awaitable, List, Optional, Tuple
+
+from sanitizer import WORD_SANITIZER
+
+
+def read_prefixes(file: str, letters: bool) -> List[str]:
+    """Return the prefixes of the sanitized strings in the CSV file <file>,
+    in order: the word prefixes of each string, or its letter prefixes if
+    <letters> is True.
+    """
+    prefixes = []
+    with open(file, encoding='utf8') as f:
+        for line in f:
+            string = line.rsplit(',', 1)[0]
+            words = [word for word in
+                     WORD_SANITIZER.sanitize_words(string.split()) if word]
+            if letters:
+                value = ' '.join(words)
+                prefixes.extend(value[:length]
+                                for length in range(1, len(value) + 1))
+            else:
+                prefixes.extend(' '.join(words[:length])
+                                for length in range(1, len(words) + 1))
+    return prefixes
+
+
+async def run_connection(open_connection: Awaitable[
+                             Tuple[asyncio.StreamReader, asyncio.StreamWriter]],
+                         prefixes: List[str], start: int, step: int,
+                         limit: int, latencies: List[float]) -> None:
+    """Send an autocomplete request for every <step>-th prefix in
+    <prefixes>, from position <start>, through the connection that
+    <open_connection> opens, one at a time, and add the time taken to
+    answer each to <latencies>.
+    """
+    reader, writer = await open_connection
+    for i in range(start, len(prefixes), step):
+        request = {'op': 'autocomplete', 'prefix': prefixes[i],
+                   'limit': limit}
+        sent = time.perf_counter()
+        writer.write(json.dumps(request).encode('utf8') + b'\n')
+        response = json.loads(await reader.readline())
+        latencies.append(time.perf_counter() - sent)
+        if 'error' in response:
+            raise RuntimeError(response['error'])
+    writer.close()
+
+
+async def run(host: str, port: int, unix: Optional[str],
+              prefixes: List[str], connections: int, limit: int) -> None:
+    """Send an autocomplete request for each of <prefixes> through
+    <connections> connections at once, and print the throughput and the
+    latency percentiles.
+    """
+    latencies = []
+    tasks = []
+    for start in range(connections):
+        if unix is not None:
+            open_connection = asyncio.open_unix_connection(unix)
+        else:
+            open_connection = asyncio.open_connection(host, port)
+        tasks.append(run_connection(open_connection, prefixes, start,
+                                    connections, limit, latencies))
+    began = time.perf_counter()
+    await asyncio.gather(*tasks)
+    seconds = time.perf_counter() - began
+
+    latencies.sort()
+    print(f'{len(latencies)} requests over {connections} connections '
+          f'in {seconds:.3f}s: {len(latencies) / seconds:.0f} requests/s')
+    for percentile in [50, 90, 99, 99.9]:
+        latency = latencies[min(len(latencies) - 1,
+                                int(len(latencies) * percentile / 100))]
+        print(f'p{percentile:<5} {latency * 1e3:8.3f}ms')
+    print(f'max    {latencies[-1] * 1e3:8.3f}ms')
+
+
+def main(arguments: Optional[List[str]] = None) -> None:
+    """Run the load generator with the command-line <arguments>, or with
+    sys.argv if <arguments> is None.
+    """
+    parser = argparse.ArgumentParser(
+        description='Replay google_searches.csv prefixes against a running '
+                    'autocomplete server.')
+    parser.add_argument('--file', default='data/google_searches.csv')
+    parser.add_argument('--letters', action='store_true',
+                        help='send letter prefixes instead of word prefixes')
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--connections', type=int, default=32)
+    parser.add_argument('--limit', type=int, default=10)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--unix', metavar='PATH',
+                        help='connect to this Unix socket instead of TCP')
+    args = parser.parse_args(arguments)
+
+    prefixes = read_prefixes(args.file, args.letters)
+    prefixes = [prefixes[i % len(prefixes)] for i in range(args.requests)]
+    asyncio.run(run(args.host, args.port, args.unix, prefixes,
+                    args.connections, args.limit))
+
+
+if __name__ == '__main__':
+    main()
@@ -8,14 +8,15 @@ University of Toronto
 This file contains some helpers used to convert between our integer-based
 representation of melodies and different music file formats.
 
+pygame and mido are only imported once a melody is played or made into a
+MIDI file, so that importing this file is quick, and Melody can be used
+where they are not installed.
+
 You should not change anything in this file.
 """
 import io
 from typing import List, Tuple
 
-import mido as mido
-import pygame as pg
-
 
 class Melody:
     """A class representing a melody.
@@ -54,6 +55,8 @@ def play_midi_sequence(notes: List[Tuple[int, int]]) -> None:
 def play_midi_file(midi_file: io.BytesIO) -> None:
     """Given a file (or file-like) MIDI object, play it using pygame.
     """
+    import pygame as pg
+
     pg.mixer.init()
     pg.mixer.music.load(midi_file)
     pg.mixer.music.play()
@@ -67,6 +70,8 @@ def create_midi_file(notes: List[Tuple[int, int]]) -> io.BytesIO:
 
     Notes are played with piano instrument.
     """
+    import mido
+
     byte_stream = io.BytesIO()
 
     mid = mido.MidiFile()
@@ -15,7 +15,38 @@ testing directly! You may, however, add new private attributes, methods, and
 top-level functions to this file.
 """
 from __future__ import annotations
-from typing import Any, List, Optional, Tuple, Callable
+import gc
+import hashlib
+import heapq
+import mmap
+import multiprocessing
+import pickle
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from itertools import islice
+from operator import attrgetter
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, \
+    Sequence, Tuple
+
+# Stored as the value of a non-leaf SimplePrefixTree whose value is built
+# from its own and its ancestors' edge elements when it is accessed.
+_DERIVED = object()
+
+# The first bytes of a file written by CompiledAutocompleter.save.
+_SNAPSHOT_MAGIC = b'PREFIXT2'
+# The header that follows them: the byte order of the machine that wrote the
+# file, then the number of nodes, label tokens, non-leaf children and values,
+# and the size in bytes of the pickled values, of the pickled tokens and of
+# the pickled tag.
+_SNAPSHOT_HEADER = struct.Struct('<c7xqqqqqqq')
+# The header is followed by the SHA-256 hash of every other byte of the file,
+# and then by the sections of the file.
+_SNAPSHOT_DIGEST = len(_SNAPSHOT_MAGIC) + _SNAPSHOT_HEADER.size
+_SNAPSHOT_SECTIONS = _SNAPSHOT_DIGEST + hashlib.sha256().digest_size
 
 
 ################################################################################
@@ -24,6 +55,8 @@ from typing import Any, List, Optional, Tuple, Callable
 class Autocompleter:
     """An abstract class representing the Autocompleter Abstract Data Type.
     """
+    __slots__ = ()
+
     def __len__(self) -> int:
         """Return the number of values stored in this Autocompleter."""
         raise NotImplementedError
@@ -59,6 +92,28 @@ class Autocompleter:
         """
         raise NotImplementedError
 
+    def autocomplete_many(self, prefixes: List[List],
+                          limit: Optional[int] = None) -> \
+            List[List[Tuple[Any, float]]]:
+        """Return the result of autocomplete(prefix, limit) for each prefix
+        in <prefixes>, in the same order.
+
+        Precondition: limit is None or limit > 0.
+        """
+        return [self.autocomplete(prefix, limit) for prefix in prefixes]
+
+    def iter_autocomplete(self, prefix: List) -> Iterator[Tuple[Any, float]]:
+        """Return an iterator over every match for the given prefix, as
+        tuples (value, weight) in the order autocomplete(prefix) returns them.
+        """
+        return iter(self.autocomplete(prefix))
+
+    def start_session(self) -> AutocompleteSession:
+        """Return a new AutocompleteSession for this Autocompleter, with an
+        empty prefix.
+        """
+        return AutocompleteSession(self)
+
     def remove(self, prefix: List) -> None:
         """Remove all values that match the given prefix.
         """
@@ -121,31 +176,149 @@ class SimplePrefixTree(Autocompleter):
     subtrees: List[SimplePrefixTree]
     weight_type: str
     # === Private Attributes ===
-    _cal_weight: Callable
+    # _value is the value of this tree, or _DERIVED for a non-leaf subtree.
+    # The value of such a subtree is _parent.value + [_element]; it is built
+    # only when accessed, so that a prefix of length n does not store n
+    # lists of up to n elements.
+    _value: Any
+    _element: Any
+    _parent: Optional[SimplePrefixTree]
+    # _info holds the state shared by every node of the tree.
+    _info: _TreeInfo
     _leaf_sum: float
     _leaf_count: int
-
-    def __init__(self, weight_type: str) -> None:
+    # _children maps the last element of each non-leaf subtree's value to
+    # that subtree, so that following a prefix never scans self.subtrees.
+    _children: Dict[Any, SimplePrefixTree]
+    # _max_leaf is the largest weight of a leaf in this tree.
+    _max_leaf: float
+    # _top_leaves caches the _info.cache_size heaviest leaves of this tree,
+    # or is None if they have not been computed since this tree last changed.
+    _top_leaves: Optional[List[Tuple[Any, float]]]
+    # _order is the number of nodes added to the tree before this one. Ties
+    # in the weights of self.subtrees are broken by increasing _order, so
+    # that a subtree can be found in it by binary search on its weight.
+    _order: int
+    # _by_max_leaf holds self.subtrees in non-increasing order of their
+    # _max_leaf, with ties broken by increasing _order, or is None if this
+    # tree has fewer than two subtrees.
+    _by_max_leaf: Optional[List[Any]]
+
+    __slots__ = ('_value', 'weight', 'subtrees', '_element', '_parent',
+                 '_info', '_leaf_sum', '_leaf_count', '_children',
+                 '_max_leaf', '_top_leaves', '_order', '_by_max_leaf')
+
+    def __init__(self, weight_type: str, cache_size: int = 0) -> None:
         """Initialize an empty simple prefix tree.
 
         Precondition: weight_type == 'sum' or weight_type == 'average'.
+                      cache_size >= 0.
 
         The given <weight_type> value specifies how the aggregate weight
         of non-leaf trees should be calculated (see the assignment handout
         for details).
-        """
-        self.value = []
-        self.weight = 0.0
-        self.subtrees = []
-        self.weight_type = weight_type
 
+        If <cache_size> is positive, every non-leaf tree caches its
+        <cache_size> heaviest leaves the first time they are asked for, so
+        that later calls to autocomplete with limit <= cache_size only need
+        to find the tree for the prefix.
+        """
         if weight_type == 'sum':
-            self._cal_weight = self._cal_sum
+            cal_weight = SimplePrefixTree._cal_sum
         else:
-            self._cal_weight = self._cal_avg
+            cal_weight = SimplePrefixTree._cal_avg
+        self._init_node(_TreeInfo(weight_type, cal_weight, cache_size))
 
+    def _init_node(self, info: _TreeInfo) -> None:
+        """Make this tree an empty node of the tree whose shared state is
+        <info>.
+        """
+        self._value = []
+        self.weight = 0.0
+        self.subtrees = []
+        self._info = info
         self._leaf_sum = 0.0
         self._leaf_count = 0
+        self._children = {}
+        self._max_leaf = 0.0
+        self._top_leaves = None
+        self._element = None
+        self._parent = None
+        self._order = info.node_count
+        info.node_count += 1
+        self._by_max_leaf = None
+
+    @classmethod
+    def bulk_load(cls, items: Iterable[Tuple[Any, float, List]],
+                  weight_type: str, cache_size: int = 0) -> SimplePrefixTree:
+        """Return a new SimplePrefixTree storing every (value, weight,
+        prefix) tuple in <items>, as if each had been inserted in turn into
+        SimplePrefixTree(weight_type, cache_size).
+
+        Rather than being updated once per insertion, the tree is built in
+        one pass over the prefixes in sorted order, and the aggregate weights
+        and order of the subtrees of each tree are computed once.
+
+        Preconditions: the preconditions of __init__ and of insert, for each
+        tuple in <items>.
+        """
+        tree = cls(weight_type, cache_size)
+        entries = _aggregate_items(items)
+        with _gc_paused():
+            # path holds the trees whose values are the prefixes of the
+            # last prefix added, from shortest to longest. Trees leave it
+            # once every value below them has been added.
+            path = [tree]
+            last_prefix = []
+            for value, weight, prefix in entries:
+                common_length = _common_length(prefix, last_prefix)
+                while len(path) > common_length + 1:
+                    _finish_tree(path.pop())
+                for element in prefix[common_length:]:
+                    subtree = tree._new_subtree()
+                    subtree._value = _DERIVED
+                    subtree._element = element
+                    subtree._parent = path[-1]
+                    path[-1]._children[element] = subtree
+                    path[-1].subtrees.append(subtree)
+                    path.append(subtree)
+
+                leaf = tree._new_subtree()
+                leaf.value = value
+                leaf.weight = weight
+                leaf._max_leaf = weight
+                path[-1].subtrees.append(leaf)
+                _index_leaf(tree._info.leaf_index, leaf)
+                last_prefix = prefix
+
+            while path:
+                _finish_tree(path.pop())
+        return tree
+
+    @property
+    def value(self) -> Any:
+        """The value stored at the root of this prefix tree."""
+        if self._value is not _DERIVED:
+            return self._value
+
+        elements = []
+        tree = self
+        while tree._value is _DERIVED:
+            elements.append(tree._element)
+            tree = tree._parent
+        elements.reverse()
+        return tree._value + elements
+
+    @value.setter
+    def value(self, value: Any) -> None:
+        """Store <value> as the value of this prefix tree."""
+        self._value = value
+
+    @property
+    def weight_type(self) -> str:
+        """The way that the aggregate weight of non-leaf trees is calculated.
+        """
+        return self._info.weight_type
 
     def is_empty(self) -> bool:
         """Return whether this simple prefix tree is empty."""
@@ -159,6 +332,28 @@ class SimplePrefixTree(Autocompleter):
         """Return the number of values stored in this SimplePrefixTree."""
         return self._leaf_count
 
+    def freeze(self) -> CompiledAutocompleter:
+        """Return a read-only CompiledAutocompleter that stores the same
+        values as this tree.
+
+        Later changes to this tree do not change the returned autocompleter.
+        """
+        return CompiledAutocompleter(self)
+
+    def save(self, path: str) -> None:
+        """Write a snapshot of this tree to the file at <path>.
+
+        The snapshot is opened by CompiledAutocompleter.load, which returns a
+        read-only autocompleter that stores the same values as this tree.
+        """
+        self.freeze().save(path)
+
+    def _cal_weight(self) -> float:
+        """Calculate the aggregate weight of this tree, as given by its
+        weight_type.
+        """
+        return self._info.cal_weight(self)
+
     def _cal_sum(self) -> float:
         """Calculate the sum of weight of leaves.
         """
@@ -188,72 +383,155 @@ class SimplePrefixTree(Autocompleter):
                 1) not in this Autocompleter
                 2) was previously inserted with the SAME prefix sequence
         """
-        if not self._leaf_has_value(value, prefix):
-            self._leaf_count += 1
-
-        if prefix == []:
-            new_tree = SimplePrefixTree(self.weight_type)
-            new_tree.value = value
-            new_tree.weight = float(weight)
-
-            subtree_with_value = self._subtree_with_value(value)
-            if subtree_with_value is not None:
-                subtree_with_value.weight += weight
-            else:
-                self.subtrees.append(new_tree)
-
+        leaf = self._leaf_with_value(value, prefix)
+
+        # path holds the trees whose values are the prefixes of <prefix>,
+        # from shortest to longest.
+        path = [self]
+        for element in prefix:
+            subtree = path[-1]._children.get(element)
+            if subtree is None:
+                subtree = path[-1]._new_subtree()
+                subtree._value = _DERIVED
+                subtree._element = element
+                subtree._parent = path[-1]
+                path[-1]._children[element] = subtree
+                path[-1].subtrees.append(subtree)
+            path.append(subtree)
+
+        if leaf is None:
+            old_weight = 0.0
+            leaf = path[-1]._new_subtree()
+            leaf.value = value
+            leaf.weight = float(weight)
+            path[-1].subtrees.append(leaf)
+            _index_leaf(self._info.leaf_index, leaf)
         else:
-            prefix_copy = prefix[:]
-            first_prefix = prefix_copy.pop(0)
-            subtree_with_value = self._subtree_with_value(self.value
-                                                          + [first_prefix])
+            old_weight = leaf.weight
+            leaf.weight += weight
+        leaf._max_leaf = leaf.weight
 
-            if subtree_with_value is not None:
-                subtree_with_value.insert(value, weight, prefix_copy)
-            else:
-                new_tree = SimplePrefixTree(self.weight_type)
-                new_tree.value = self.value + [first_prefix]
-                self.subtrees.append(new_tree)
-                new_tree.insert(value, weight, prefix_copy)
+        _update_path(path, leaf, weight, old_weight)
+
+    def merge(self, other: SimplePrefixTree) -> None:
+        """Insert every value stored in <other> into this tree, with its
+        weight and prefix sequence in <other>, as if by insert.
 
-        self._leaf_sum += weight
-        self.weight = self._cal_weight()
+        Rather than inserting the values one at a time, the two trees are
+        walked together: a subtree of <other> whose prefix is not in this
+        tree is copied whole, and the aggregate weight and order of the
+        subtrees of each tree that changes are computed once. <other> is not
+        changed.
 
-        self.subtrees.sort(reverse=True)
+        Preconditions:
+            <other> is a SimplePrefixTree other than this tree, with the
+            same weight_type.
+            The preconditions of insert, for each value in <other>.
+        """
+        with _gc_paused():
+            # stack holds pairs of trees with the same value, whose subtrees
+            # are still to be merged, and (tree, None) for each tree to be
+            # finished once everything below it has been merged.
+            stack = [(self, other)]
+            while stack:
+                tree, other_tree = stack.pop()
+                if other_tree is None:
+                    _finish_tree(tree)
+                    tree._top_leaves = None
+                    continue
+                stack.append((tree, None))
+                for subtree in other_tree.subtrees:
+                    if subtree.subtrees == []:
+                        _merge_leaf(tree, subtree)
+                    elif subtree._element in tree._children:
+                        stack.append((tree._children[subtree._element],
+                                      subtree))
+                    else:
+                        _copy_subtree(tree, subtree)
 
     def __lt__(self, other: SimplePrefixTree) -> bool:
         """Return a boolean based on the comparison between self and other.
         """
         return self.weight < other.weight
 
+    def _new_subtree(self) -> SimplePrefixTree:
+        """Return a new empty node of the tree this tree belongs to, to be
+        added below this tree.
+        """
+        new_tree = SimplePrefixTree.__new__(SimplePrefixTree)
+        new_tree._init_node(self._info)
+        return new_tree
+
+    def _add_copy(self, subtree: SimplePrefixTree) -> SimplePrefixTree:
+        """Add a copy of <subtree> of another tree, without its own
+        subtrees, to the end of self.subtrees, and return the copy.
+
+        Precondition: <subtree> is a leaf, or its value is self.value plus
+        one element.
+        """
+        new_tree = self._new_subtree()
+        if subtree.subtrees == []:
+            new_tree.value = subtree.value
+            _index_leaf(self._info.leaf_index, new_tree)
+        else:
+            new_tree._value = _DERIVED
+            new_tree._element = subtree._element
+            new_tree._parent = self
+            self._children[subtree._element] = new_tree
+        new_tree.weight = subtree.weight
+        new_tree._leaf_sum = subtree._leaf_sum
+        new_tree._leaf_count = subtree._leaf_count
+        new_tree._max_leaf = subtree._max_leaf
+        self.subtrees.append(new_tree)
+        return new_tree
+
     def _subtree_with_value(self, value: Any) -> Optional[SimplePrefixTree]:
-        """Return the subtree in self.subtrees whose value attribute is the
+        """Return the leaf in self.subtrees whose value attribute is the
         same with value.
         """
         for subtree in self.subtrees:
-            if subtree.value == value:
+            if subtree.is_leaf() and subtree.value == value:
                 return subtree
         return None
 
-    def _leaf_has_value(self, value: Any, prefix: List) -> bool:
-        """Return True if the leaves of self has the input value.
+    def _subtree_with_prefix(self, prefix: List) -> \
+            Optional[SimplePrefixTree]:
+        """Return the subtree of this tree reached by following <prefix> one
+        element at a time, or None if there is no such subtree.
         """
-        if self.is_empty():
-            return False
-        else:
-            for subtree in self.subtrees:
-                if subtree.is_leaf():
-                    return subtree.value == value
+        subtree = self
+        for element in prefix:
+            subtree = subtree._children.get(element)
+            if subtree is None:
+                return None
+        return subtree
+
+    def _step(self, length: int, element: Any) -> \
+            Optional[SimplePrefixTree]:
+        """Return the subtree for a prefix of length <length> followed by
+        <element>, given that this is the subtree for that prefix, or None
+        if there is no such subtree.
+        """
+        return self._children.get(element)
 
-                length = len(subtree.value)
-                if (self.value + prefix)[:length] != subtree.value:
-                    continue
-                else:
-                    prefix_copy = prefix[:]
-                    prefix_copy.pop(0)
-                    if subtree._leaf_has_value(value, prefix_copy):
-                        return True
-            return False
+    def _leaf_with_value(self, value: Any, prefix: List) -> \
+            Optional[SimplePrefixTree]:
+        """Return the leaf storing <value>, which was inserted with <prefix>,
+        or None if <value> is not in this tree.
+        """
+        try:
+            return self._info.leaf_index.get(value)
+        except TypeError:
+            # Unhashable values are not indexed; look for them under prefix.
+            subtree = self._subtree_with_prefix(prefix)
+            if subtree is None:
+                return None
+            return subtree._subtree_with_value(value)
+
+    def _leaves(self) -> List[SimplePrefixTree]:
+        """Return a list of the leaves of this tree.
+        """
+        return _leaves(self)
 
     def __str__(self) -> str:
         """Return a string representation of this tree.
@@ -267,13 +545,7 @@ class SimplePrefixTree(Autocompleter):
 
         The indentation level is specified by the <depth> parameter.
         """
-        if self.is_empty():
-            return ''
-        else:
-            s = '  ' * depth + f'{self.value} ({self.weight})\n'
-            for subtree in self.subtrees:
-                s += subtree._str_indented(depth + 1)
-            return s
+        return _str_indented(self, depth)
 
     def autocomplete(self, prefix: List,
                      limit: Optional[int] = None) -> List[Tuple[Any, float]]:
@@ -288,117 +560,134 @@ class SimplePrefixTree(Autocompleter):
         """
         if self.is_empty():
             return []
-        elif self.is_leaf():
-            return []
-        elif self.value == prefix:
-            return self._leaf_value_weight(limit)
-        else:
-            for subtree in self.subtrees:
-                length = len(subtree.value)
-                if prefix[:length] != subtree.value:
-                    continue
-                else:
-                    if subtree.autocomplete(prefix, limit):
-                        return subtree.autocomplete(prefix, limit)
+        subtree = self._subtree_with_prefix(prefix)
+        if subtree is None:
             return []
+        return subtree._leaf_value_weight(limit)
 
-    def _leaf_value_weight(self, limit: Optional[int] = None) -> \
-            List[Tuple[Any, float]]:
-        """Return a list of tuple consisting of each leaf's value and weight.
-        """
-        if self.is_empty():
-            return []
-        elif self.is_leaf():
-            return [(self.value, self.weight)]
-        else:
-            leaf_list = []
-            for subtree in self.subtrees:
-                if limit is None:
-                    leaf_list.extend(subtree._leaf_value_weight())
-                elif len(leaf_list) < limit:
-                    leaf_list.extend(subtree._leaf_value_weight(limit -
-                                                                len(leaf_list)))
-                else:
-                    break
-            return sorted(leaf_list, key=lambda x: x[1], reverse=True)
+    def iter_autocomplete(self, prefix: List) -> Iterator[Tuple[Any, float]]:
+        """Return an iterator over every match for the given prefix, as
+        tuples (value, weight) in non-increasing order of weight.
 
-    def remove(self, prefix: List) -> None:
-        """Remove all values that match the given prefix.
+        Each match is found as it is taken from the iterator, so taking the
+        first n matches costs about as much as autocomplete(prefix, n). This
+        tree must not change while the iterator is used.
         """
         if self.is_empty():
-            pass
-        elif self.is_leaf():
-            pass
-        elif self._recursive_subtree_with_value(prefix) is None:
-            pass
-        elif self._subtree_with_value(prefix):
-            subtree_with_value = self._subtree_with_value(prefix)
-            self._leaf_sum -= subtree_with_value._leaf_sum
-            self._leaf_count -= subtree_with_value._leaf_count
-            self.weight = self._cal_weight()
-            self.subtrees.remove(self._subtree_with_value(prefix))
-        else:
-            recursive_subtree = self._recursive_subtree_with_value(prefix)
-            self._leaf_sum -= recursive_subtree._leaf_sum
-            self._leaf_count -= recursive_subtree._leaf_count
-            self.weight = self._cal_weight()
-            for subtree in self.subtrees:
-                length = len(subtree.value)
-                if prefix[:length] != subtree.value:
-                    continue
-                else:
-                    subtree.remove(prefix)
+            return iter([])
+        subtree = self._subtree_with_prefix(prefix)
+        if subtree is None:
+            return iter([])
+        return _iter_heaviest_leaves(subtree)
+
+    def start_session(self) -> AutocompleteSession:
+        """Return a new AutocompleteSession for this tree, with an empty
+        prefix.
+
+        The session keeps the subtree for each length of its prefix, so
+        this tree must not change while the session is used.
+        """
+        return _TreeSession(self)
 
-        self._remove_empty_subtree(prefix)
-        self.subtrees.sort(reverse=True)
+    def autocomplete_many(self, prefixes: List[List],
+                          limit: Optional[int] = None) -> \
+            List[List[Tuple[Any, float]]]:
+        """Return the result of autocomplete(prefix, limit) for each prefix
+        in <prefixes>, in the same order.
 
-    def _recursive_subtree_with_value(self, value: list) -> \
-            Optional[SimplePrefixTree]:
-        """Return a SimplePrefixTree if the subtrees of self is that value.
+        The prefixes are followed in sorted order, each starting from the
+        subtree of the part it shares with the previous one, and the matches
+        in each subtree are found only once.
+
+        Precondition: limit is None or limit > 0.
         """
+        results = [[] for _ in prefixes]
         if self.is_empty():
-            return None
-        elif self.is_leaf():
-            return None
-        elif self.value == value:
-            return self
-        else:
-            for subtree in self.subtrees:
-                length = len(subtree.value)
-                if value[:length] != subtree.value:
-                    continue
-                else:
-                    recursive_subtree = subtree.\
-                        _recursive_subtree_with_value(value)
-                    if recursive_subtree is not None:
-                        return recursive_subtree
-            return None
+            return results
+        # path holds the subtrees reached by following the previous prefix,
+        # from this tree on; it is shorter if that prefix was not found.
+        path = [self]
+        last_prefix = []
+        matches = {}
+        for i in sorted(range(len(prefixes)), key=prefixes.__getitem__):
+            prefix = prefixes[i]
+            del path[_common_length(prefix, last_prefix, 0,
+                                    len(path) - 1) + 1:]
+            for element in prefix[len(path) - 1:]:
+                subtree = path[-1]._children.get(element)
+                if subtree is None:
+                    break
+                path.append(subtree)
+            last_prefix = prefix
+            if len(path) == len(prefix) + 1:
+                results[i] = _shared_matches(matches, path[-1], limit)
+        return results
 
-    def _remove_empty_subtree(self, prefix: list) -> None:
-        """Remove all empty subtree in this tree.
+    def _leaf_value_weight(self, limit: Optional[int] = None) -> \
+            List[Tuple[Any, float]]:
+        """Return a list of tuple consisting of up to <limit> leaves' value
+        and weight, for the heaviest leaves in this tree, in non-increasing
+        order of weight.
         """
-        if self.is_empty():
-            pass
-        elif self.is_leaf():
-            pass
-        elif self._zero_weight_subtree() is not None:
-            self.subtrees.remove(self._zero_weight_subtree())
-        else:
-            for subtree in self.subtrees:
-                length = len(subtree.value)
-                if prefix[:length] != subtree.value:
-                    continue
-                else:
-                    subtree._remove_empty_subtree(prefix)
+        cache_size = self._info.cache_size
+        if limit is not None and limit <= cache_size:
+            if self._top_leaves is None:
+                self._top_leaves = _heaviest_leaves(self, cache_size)
+            return self._top_leaves[:limit]
+        return _heaviest_leaves(self, limit)
 
-    def _zero_weight_subtree(self) -> Optional[SimplePrefixTree]:
-        """Return the subtree of this tree whose weight is zero.
-        If there is none, return None instead.
+    def remove(self, prefix: List) -> None:
+        """Remove all values that match the given prefix.
         """
-        for subtree in self.subtrees:
-            if subtree.weight == 0:
-                return subtree
-        return None
+        if prefix == []:
+            self.subtrees = []
+            self._by_max_leaf = None
+            self._children = {}
+            self._info.leaf_index.clear()
+            self._leaf_sum = 0.0
+            self._leaf_count = 0
+            self._max_leaf = 0.0
+            self._top_leaves = None
+            self.weight = 0.0
+            return
+
+        # path holds the trees whose values are the prefixes of <prefix>,
+        # from shortest to longest.
+        path = [self]
+        for element in prefix:
+            subtree = path[-1]._children.get(element)
+            if subtree is None:
+                return
+            path.append(subtree)
+
+        removed_tree = path.pop()
+        for leaf in removed_tree._leaves():
+            _unindex_leaf(self._info.leaf_index, leaf)
+
+        changed_subtree = removed_tree
+        changed_weight = removed_tree.weight
+        changed_max_leaf = removed_tree._max_leaf
+        for i in range(len(path) - 1, -1, -1):
+            tree = path[i]
+            tree_weight = tree.weight
+            tree_max_leaf = tree._max_leaf
+            tree._leaf_sum -= removed_tree._leaf_sum
+            tree._leaf_count -= removed_tree._leaf_count
+            if tree._leaf_count == 0:
+                tree._leaf_sum = 0.0
+            tree.weight = tree._cal_weight()
+            tree._top_leaves = None
+
+            if changed_subtree is removed_tree or changed_subtree.is_empty():
+                del tree._children[prefix[i]]
+                _remove_subtree(tree, changed_subtree, changed_weight,
+                                changed_max_leaf)
+            else:
+                _reorder_subtree(tree, changed_subtree, changed_weight,
+                                 changed_max_leaf)
+            changed_subtree = tree
+            changed_weight = tree_weight
+            changed_max_leaf = tree_max_leaf
 
 
 ################################################################################
@@ -456,31 +745,167 @@ class CompressedPrefixTree(Autocompleter):
     subtrees: List[CompressedPrefixTree]
     weight_type: str
     # === Private Attributes ===
-    _cal_weight: Callable
+    # The value of a non-leaf tree is a list of the first _length elements of
+    # _key, which holds the elements of a prefix that was inserted into the
+    # tree (see _pack_key). Trees along the path to that prefix share _key,
+    # and the value is only built when it is accessed. _key is None for a
+    # leaf, whose value is _value.
+    _key: Optional[Sequence]
+    _length: int
+    _value: Any
+    # _info holds the state shared by every node of the tree.
+    _info: _TreeInfo
     _leaf_sum: float
     _leaf_count: int
-
-    def __init__(self, weight_type: str) -> None:
+    # _children maps the first element of each non-leaf subtree's value
+    # after self.value to that subtree. No two non-leaf subtrees share that
+    # element, so following a prefix never scans self.subtrees.
+    _children: Dict[Any, CompressedPrefixTree]
+    # _max_leaf is the largest weight of a leaf in this tree.
+    _max_leaf: float
+    # _top_leaves caches the _info.cache_size heaviest leaves of this tree,
+    # or is None if they have not been computed since this tree last changed.
+    _top_leaves: Optional[List[Tuple[Any, float]]]
+    # _order is the number of nodes added to the tree before this one. Ties
+    # in the weights of self.subtrees are broken by increasing _order, so
+    # that a subtree can be found in it by binary search on its weight.
+    _order: int
+    # _by_max_leaf holds self.subtrees in non-increasing order of their
+    # _max_leaf, with ties broken by increasing _order, or is None if this
+    # tree has fewer than two subtrees.
+    _by_max_leaf: Optional[List[Any]]
+
+    __slots__ = ('_key', '_length', '_value', 'weight', 'subtrees', '_info',
+                 '_leaf_sum', '_leaf_count', '_children', '_max_leaf',
+                 '_top_leaves', '_order', '_by_max_leaf')
+
+    def __init__(self, weight_type: str, cache_size: int = 0) -> None:
         """Initialize an empty compressed prefix tree.
 
         Precondition: weight_type == 'sum' or weight_type == 'average'.
+                      cache_size >= 0.
 
         The given <weight_type> value specifies how the aggregate weight
         of non-leaf trees should be calculated (see the assignment handout
         for details).
-        """
-        self.value = []
-        self.weight = 0.0
-        self.subtrees = []
-        self.weight_type = weight_type
 
+        If <cache_size> is positive, every non-leaf tree caches its
+        <cache_size> heaviest leaves the first time they are asked for, so
+        that later calls to autocomplete with limit <= cache_size only need
+        to find the tree for the prefix.
+        """
         if weight_type == 'sum':
-            self._cal_weight = self._cal_sum
+            cal_weight = CompressedPrefixTree._cal_sum
         else:
-            self._cal_weight = self._cal_avg
+            cal_weight = CompressedPrefixTree._cal_avg
+        self._init_node(_TreeInfo(weight_type, cal_weight, cache_size))
 
+    def _init_node(self, info: _TreeInfo) -> None:
+        """Make this tree an empty node of the tree whose shared state is
+        <info>.
+        """
+        self._key = ()
+        self._length = 0
+        self._value = None
+        self.weight = 0.0
+        self.subtrees = []
+        self._info = info
         self._leaf_sum = 0.0
         self._leaf_count = 0
+        self._children = {}
+        self._max_leaf = 0.0
+        self._top_leaves = None
+        self._order = info.node_count
+        info.node_count += 1
+        self._by_max_leaf = None
+
+    @classmethod
+    def bulk_load(cls, items: Iterable[Tuple[Any, float, List]],
+                  weight_type: str,
+                  cache_size: int = 0) -> CompressedPrefixTree:
+        """Return a new CompressedPrefixTree storing every (value, weight,
+        prefix) tuple in <items>, as if each had been inserted in turn into
+        CompressedPrefixTree(weight_type, cache_size).
+
+        Rather than being updated once per insertion, the tree is built in
+        one pass over the prefixes in sorted order, and the aggregate weights
+        and order of the subtrees of each tree are computed once.
+
+        Preconditions: the preconditions of __init__ and of insert, for each
+        tuple in <items>.
+        """
+        tree = cls(weight_type, cache_size)
+        entries = _aggregate_items(items)
+        with _gc_paused():
+            # path holds the trees whose values are prefixes of the last
+            # prefix added, from shortest to longest. Trees leave it once
+            # every value below them has been added.
+            path = [tree]
+            last_prefix = []
+            for value, weight, prefix in entries:
+                common_length = _common_length(prefix, last_prefix)
+                while path[-1]._length > common_length:
+                    subtree = path.pop()
+                    _finish_tree(subtree)
+                    if path[-1]._length < common_length:
+                        # The new prefix leaves subtree's edge part of the way
+                        # along it, so the edge is split there. subtree is the
+                        # last subtree added to path[-1].
+                        element = subtree._key[path[-1]._length]
+                        new_tree = tree._new_subtree()
+                        new_tree._set_prefix(subtree._key, common_length)
+                        new_tree.subtrees.append(subtree)
+                        new_tree._children[subtree._key[common_length]] = \
+                            subtree
+                        path[-1].subtrees[-1] = new_tree
+                        path[-1]._children[element] = new_tree
+                        path.append(new_tree)
+                if path[-1]._length < len(prefix):
+                    subtree = tree._new_subtree()
+                    subtree._set_prefix(_pack_key(prefix), len(prefix))
+                    path[-1].subtrees.append(subtree)
+                    path[-1]._children[prefix[path[-1]._length]] = subtree
+                    path.append(subtree)
+
+                leaf = tree._new_subtree()
+                leaf.value = value
+                leaf.weight = weight
+                leaf._max_leaf = weight
+                path[-1].subtrees.append(leaf)
+                _index_leaf(tree._info.leaf_index, leaf)
+                last_prefix = prefix
+
+            while path:
+                _finish_tree(path.pop())
+            tree._merge_root()
+        return tree
+
+    @property
+    def value(self) -> Any:
+        """The value stored at the root of this prefix tree."""
+        if self._key is None:
+            return self._value
+        return list(self._key[:self._length])
+
+    @value.setter
+    def value(self, value: Any) -> None:
+        """Store <value> as the value of this prefix tree, which is a leaf.
+        """
+        self._key = None
+        self._value = value
+
+    def _set_prefix(self, key: Sequence, length: int) -> None:
+        """Make the first <length> elements of <key> the value of this
+        non-leaf tree.
+        """
+        self._key = key
+        self._length = length
+
+    @property
+    def weight_type(self) -> str:
+        """The way that the aggregate weight of non-leaf trees is calculated.
+        """
+        return self._info.weight_type
 
     def is_empty(self) -> bool:
         """Return whether this simple prefix tree is empty."""
@@ -494,6 +919,28 @@ class CompressedPrefixTree(Autocompleter):
         """Return the number of values stored in this SimplePrefixTree."""
         return self._leaf_count
 
+    def freeze(self) -> CompiledAutocompleter:
+        """Return a read-only CompiledAutocompleter that stores the same
+        values as this tree.
+
+        Later changes to this tree do not change the returned autocompleter.
+        """
+        return CompiledAutocompleter(self)
+
+    def save(self, path: str) -> None:
+        """Write a snapshot of this tree to the file at <path>.
+
+        The snapshot is opened by CompiledAutocompleter.load, which returns a
+        read-only autocompleter that stores the same values as this tree.
+        """
+        self.freeze().save(path)
+
+    def _cal_weight(self) -> float:
+        """Calculate the aggregate weight of this tree, as given by its
+        weight_type.
+        """
+        return self._info.cal_weight(self)
+
     def _cal_sum(self) -> float:
         """Calculate the sum of weight of leaves.
         """
@@ -523,131 +970,229 @@ class CompressedPrefixTree(Autocompleter):
                 1) not in this Autocompleter
                 2) was previously inserted with the SAME prefix sequence
         """
-        if self.value != []:
-            self._add_head()
-        self._insert(value, weight, prefix)
-        self._remove_head()
-
-        # value: Optional[Any]
-        # weight: float
-        # subtrees: List[CompressedPrefixTree]
-        # weight_type: str
-        # # === Private Attributes ===
-        # _cal_weight: Callable
-        # _leaf_sum: float
-        # _leaf_count: int
-
-    def _add_head(self) -> None:
-        """Add an empty list head for self."""
-        new_tree = CompressedPrefixTree(self.weight_type)
-        new_tree.value = self.value
-        new_tree._leaf_sum = self._leaf_sum
-        new_tree._leaf_count = self._leaf_count
-        new_tree.weight = self.weight
-        new_tree.subtrees = self.subtrees
-        self.value = []
-        self.subtrees = []
-        self.subtrees.insert(0, new_tree)
-
-    def _insert(self, value: Any, weight: float, prefix: List) -> None:
-        """Helper function for self.insert."""
-        if not self._leaf_has_value(value, prefix):
-            self._leaf_count += 1
-
-        if prefix == self.value:
-            subtree_with_value = self._subtree_with_value(value)
-            if subtree_with_value is not None:
-                subtree_with_value.weight += weight
+        leaf = self._leaf_with_value(value, prefix)
+        common_length = _common_length(prefix, self._key, 0, self._length)
+        if self.is_empty():
+            self._set_prefix(_pack_key(prefix), len(prefix))
+        elif common_length < self._length:
+            self._split(common_length)
+
+        # path holds the trees whose values are the prefixes of <prefix>,
+        # from shortest to longest, splitting or adding trees as needed.
+        path = [self]
+        while path[-1]._length < len(prefix):
+            tree = path[-1]
+            element = prefix[tree._length]
+            subtree = tree._children.get(element)
+            if subtree is None:
+                subtree = tree._new_subtree()
+                subtree._set_prefix(_pack_key(prefix), len(prefix))
+                tree._children[element] = subtree
+                tree.subtrees.append(subtree)
             else:
-                new_tree = CompressedPrefixTree(self.weight_type)
-                new_tree.value = value
-                new_tree.weight = float(weight)
-                self.subtrees.append(new_tree)
-
-        elif not self._common_prefix(prefix):
-            new_tree = CompressedPrefixTree(self.weight_type)
-            new_tree.value = prefix
-            new_tree.weight = float(weight)
-            self.subtrees.append(new_tree)
-            new_tree._insert(value, weight, prefix)
-
-        elif (len(self._common_prefix(prefix)[0]) <
-              len(self._common_prefix(prefix)[1].value)):
-            new_tuple = self._common_prefix(prefix)
-            common_prefix = new_tuple[0]
-            common_prefix_subtree = new_tuple[1]
-
-            self.subtrees.remove(common_prefix_subtree)
-
-            new_tree = CompressedPrefixTree(self.weight_type)
-            new_tree.value = common_prefix
-            new_tree.subtrees.append(common_prefix_subtree)
-            new_tree._leaf_count += common_prefix_subtree._leaf_count
-            new_tree._leaf_sum += common_prefix_subtree._leaf_sum
-
-            self.subtrees.append(new_tree)
-
-            new_tree._insert(value, weight, prefix)
-
+                length = _common_length(prefix, subtree._key,
+                                        tree._length + 1, subtree._length)
+                if length < subtree._length:
+                    subtree._split(length)
+            path.append(subtree)
+
+        if leaf is None:
+            old_weight = 0.0
+            leaf = path[-1]._new_subtree()
+            leaf.value = value
+            leaf.weight = float(weight)
+            path[-1].subtrees.append(leaf)
+            _index_leaf(self._info.leaf_index, leaf)
         else:
-            common_prefix_subtree = self._common_prefix(prefix)[1]
-            common_prefix_subtree._insert(value, weight, prefix)
+            old_weight = leaf.weight
+            leaf.weight += weight
+        leaf._max_leaf = leaf.weight
 
-        self._leaf_sum += weight
-        self.weight = self._cal_weight()
+        _update_path(path, leaf, weight, old_weight)
 
-        self.subtrees.sort(reverse=True)
+    def merge(self, other: CompressedPrefixTree) -> None:
+        """Insert every value stored in <other> into this tree, with its
+        weight and prefix sequence in <other>, as if by insert.
 
-    def _common_prefix(self, prefix: List) -> \
-            Optional[Tuple[list, CompressedPrefixTree]]:
-        """Return a tuple consisting of a list of common prefix and the subtree
-        that has the common prefix.
-        """
-        common_prefix = []
-        for subtree in self.subtrees:
-            if not subtree.is_leaf():
-                i = len(self.value)
-                while ((i < len(prefix) and i < len(subtree.value))
-                       and prefix[i] == subtree.value[i]):
-                    common_prefix.append(prefix[i])
-                    i += 1
+        Rather than inserting the values one at a time, the two trees are
+        walked together: a subtree of <other> whose prefix is not in this
+        tree is copied whole, and the aggregate weight and order of the
+        subtrees of each tree that changes are computed once. <other> is not
+        changed.
 
-            if common_prefix:
-                return self.value + common_prefix, subtree
-
-        return None
+        Preconditions:
+            <other> is a CompressedPrefixTree other than this tree, with the
+            same weight_type.
+            The preconditions of insert, for each value in <other>.
+        """
+        if other.is_empty():
+            return
+        with _gc_paused():
+            if self.is_empty():
+                self._set_prefix(other._key, other._length)
+            else:
+                common_length = _common_length(
+                    other._key, self._key, 0,
+                    min(self._length, other._length))
+                if common_length < self._length:
+                    self._split(common_length)
+
+            # stack holds pairs of trees with the same value, whose subtrees
+            # are still to be merged, and (tree, None) for each tree to be
+            # finished once everything below it has been merged.
+            if self._length == other._length:
+                stack = [(self, other)]
+            else:
+                stack = [(self, None)]
+                self._merge_subtree(other, stack)
+            while stack:
+                tree, other_tree = stack.pop()
+                if other_tree is None:
+                    _finish_tree(tree)
+                    tree._top_leaves = None
+                    continue
+                stack.append((tree, None))
+                for subtree in other_tree.subtrees:
+                    if subtree.subtrees == []:
+                        _merge_leaf(tree, subtree)
+                    else:
+                        tree._merge_subtree(subtree, stack)
+
+    def _merge_subtree(self, subtree: CompressedPrefixTree,
+                       stack: List[Tuple[CompressedPrefixTree,
+                                         Optional[CompressedPrefixTree]]]) \
+            -> None:
+        """Helper function of merge.
+
+        Find the place of non-leaf <subtree> of another tree below this
+        tree, splitting a subtree of this tree if needed. Copy <subtree>
+        there if this tree has no tree with the same value, and otherwise
+        push that tree and <subtree> onto <stack>. Push (tree, None) onto
+        <stack> for each tree below this one whose contents change.
+
+        Precondition: self.value is a proper prefix of subtree.value.
+        """
+        tree = self
+        while True:
+            child = tree._children.get(subtree._key[tree._length])
+            if child is None:
+                _copy_subtree(tree, subtree)
+                return
+            length = _common_length(subtree._key, child._key,
+                                    tree._length + 1,
+                                    min(child._length, subtree._length))
+            if length < child._length:
+                child._split(length)
+                if length < subtree._length:
+                    _copy_subtree(child, subtree)
+                    stack.append((child, None))
+                    return
+            if length == subtree._length:
+                stack.append((child, subtree))
+                return
+            stack.append((child, None))
+            tree = child
+
+    def _split(self, length: int) -> None:
+        """Move the contents of this tree into a new subtree, leaving only
+        the first <length> elements of its value.
+
+        This tree keeps its place among the subtrees of its parent, since
+        its weight does not change.
+
+        Precondition: this tree is a non-empty non-leaf tree, and
+        length < len(self.value). If this tree is not the root, length is
+        greater than the length of its parent's value.
+        """
+        new_tree = self._new_subtree()
+        new_tree._set_prefix(self._key, self._length)
+        new_tree.subtrees = self.subtrees
+        new_tree._leaf_sum = self._leaf_sum
+        new_tree._leaf_count = self._leaf_count
+        new_tree.weight = self.weight
+        new_tree._max_leaf = self._max_leaf
+        new_tree._children = self._children
+        new_tree._top_leaves = self._top_leaves
+        new_tree._by_max_leaf = self._by_max_leaf
+        self._length = length
+        self.subtrees = [new_tree]
+        self._by_max_leaf = None
+        self._children = {self._key[length]: new_tree}
+        self._top_leaves = None
+
+    def _merge_root(self) -> None:
+        """Replace the contents of this tree with those of its only subtree,
+        if it has one subtree and that subtree is not a leaf, so that it is
+        not compressible.
+
+        Precondition: this tree is the root of its tree.
+        """
+        if len(self.subtrees) == 1 and self.subtrees[0].subtrees != []:
+            subtree = self.subtrees[0]
+            self._set_prefix(subtree._key, subtree._length)
+            self.subtrees = subtree.subtrees
+            self._by_max_leaf = subtree._by_max_leaf
+            self._children = subtree._children
+            self._top_leaves = subtree._top_leaves
 
     def __lt__(self, other: SimplePrefixTree) -> bool:
         """Return a boolean based on the comparison between self and other.
         """
         return self.weight < other.weight
 
-    def _subtree_with_value(self, value: Any) -> Optional[CompressedPrefixTree]:
-        """Return the subtree in self.subtrees whose value attribute is the
-        same with value.
+    def _new_subtree(self) -> CompressedPrefixTree:
+        """Return a new empty node of the tree this tree belongs to, to be
+        added below this tree.
         """
-        for subtree in self.subtrees:
-            if subtree.value == value:
-                return subtree
-        return None
-
-    def _leaf_has_value(self, value: Any, prefix: List) -> bool:
-        """Return True if the leaves of self has the input value.
+        new_tree = CompressedPrefixTree.__new__(CompressedPrefixTree)
+        new_tree._init_node(self._info)
+        return new_tree
+
+    def _add_copy(self, subtree: CompressedPrefixTree) -> \
+            CompressedPrefixTree:
+        """Add a copy of <subtree> of another tree, without its own
+        subtrees, to the end of self.subtrees, and return the copy.
+
+        Precondition: <subtree> is a leaf, or self.value is a proper prefix
+        of its value and no non-leaf subtree of this tree has the same
+        first element after self.value.
         """
-        if self.is_empty():
-            return False
+        new_tree = self._new_subtree()
+        if subtree.subtrees == []:
+            new_tree.value = subtree.value
+            _index_leaf(self._info.leaf_index, new_tree)
         else:
-            for subtree in self.subtrees:
-                if subtree.is_leaf():
-                    return subtree.value == value
+            new_tree._set_prefix(subtree._key, subtree._length)
+            self._children[subtree._key[self._length]] = new_tree
+        new_tree.weight = subtree.weight
+        new_tree._leaf_sum = subtree._leaf_sum
+        new_tree._leaf_count = subtree._leaf_count
+        new_tree._max_leaf = subtree._max_leaf
+        self.subtrees.append(new_tree)
+        return new_tree
+
+    def _leaf_with_value(self, value: Any, prefix: List) -> \
+            Optional[CompressedPrefixTree]:
+        """Return the leaf storing <value>, which was inserted with <prefix>,
+        or None if <value> is not in this tree.
+        """
+        try:
+            return self._info.leaf_index.get(value)
+        except TypeError:
+            # Unhashable values are not indexed; look for them among the
+            # leaves of the tree whose value is prefix.
+            subtree = self._subtree_with_prefix(prefix)
+            if subtree is None or subtree._length != len(prefix):
+                return None
+            for leaf in subtree.subtrees:
+                if leaf.subtrees == [] and leaf.value == value:
+                    return leaf
+            return None
 
-                length = min(len(prefix), len(subtree.value))
-                if prefix[:length] != subtree.value[:length]:
-                    continue
-                else:
-                    if subtree._leaf_has_value(value, prefix):
-                        return True
-            return False
+    def _leaves(self) -> List[CompressedPrefixTree]:
+        """Return a list of the leaves of this tree.
+        """
+        return _leaves(self)
 
     def __str__(self) -> str:
         """Return a string representation of this tree.
@@ -661,13 +1206,7 @@ class CompressedPrefixTree(Autocompleter):
 
         The indentation level is specified by the <depth> parameter.
         """
-        if self.is_empty():
-            return ''
-        else:
-            s = '  ' * depth + f'{self.value} ({self.weight})\n'
-            for subtree in self.subtrees:
-                s += subtree._str_indented(depth + 1)
-            return s
+        return _str_indented(self, depth)
 
     def autocomplete(self, prefix: List,
                      limit: Optional[int] = None) -> List[Tuple[Any, float]]:
@@ -680,208 +1219,1572 @@ class CompressedPrefixTree(Autocompleter):
 
         Precondition: limit is None or limit > 0.
         """
-        if self.value != []:
-            self._add_head()
-        return_list = self._autocomplete(prefix, limit)
-        self._remove_head()
-        return return_list
-
-    def _autocomplete(self, prefix: List,
-                      limit: Optional[int] = None) -> List[Tuple[Any, float]]:
-        """Helper function for self.autocomplete."""
-        if self.is_empty():
-            return []
-        elif self.is_leaf():
-            return []
-        elif self._has_common_prefix(prefix):
-            return self._leaf_value_weight(limit)
-        else:
-            for subtree in self.subtrees:
-                length = min(len(prefix), len(subtree.value))
-                if prefix[:length] != subtree.value[:length]:
-                    continue
-                else:
-                    if subtree._autocomplete(prefix, limit):
-                        return subtree._autocomplete(prefix, limit)
+        subtree = self._subtree_with_prefix(prefix)
+        if subtree is None or subtree.is_empty():
             return []
+        return subtree._leaf_value_weight(limit)
 
-    def _has_common_prefix(self, prefix: list) -> bool:
-        """Return whether self.value has common prefix with prefix.
+    def iter_autocomplete(self, prefix: List) -> Iterator[Tuple[Any, float]]:
+        """Return an iterator over every match for the given prefix, as
+        tuples (value, weight) in non-increasing order of weight.
+
+        Each match is found as it is taken from the iterator, so taking the
+        first n matches costs about as much as autocomplete(prefix, n). This
+        tree must not change while the iterator is used.
         """
-        common_prefix = []
-        i = 0
-        while i < len(self.value) and i < len(prefix):
-            if self.value[i] != prefix[i]:
-                break
-            else:
-                common_prefix.append(prefix[i])
-                i += 1
+        subtree = self._subtree_with_prefix(prefix)
+        if subtree is None or subtree.is_empty():
+            return iter([])
+        return _iter_heaviest_leaves(subtree)
+
+    def _subtree_with_prefix(self, prefix: List) -> \
+            Optional[CompressedPrefixTree]:
+        """Return the tree with the shortest value that starts with
+        <prefix>, or None if there is no such tree.
+        """
+        if (_common_length(prefix, self._key, 0, self._length)
+                < min(self._length, len(prefix))):
+            return None
+        tree = self
+        while tree._length < len(prefix):
+            subtree = tree._children.get(prefix[tree._length])
+            if subtree is None:
+                return None
+            length = _common_length(prefix, subtree._key, tree._length + 1,
+                                    subtree._length)
+            if length < len(prefix) and length < subtree._length:
+                return None
+            tree = subtree
+        return tree
+
+    def _step(self, length: int, element: Any) -> \
+            Optional[CompressedPrefixTree]:
+        """Return the tree with the shortest value that starts with a
+        prefix of length <length> followed by <element>, given that this is
+        that tree for the prefix, or None if there is no such tree.
+        """
+        if length < self._length:
+            if self._key[length] == element:
+                return self
+            return None
+        return self._children.get(element)
+
+    def start_session(self) -> AutocompleteSession:
+        """Return a new AutocompleteSession for this tree, with an empty
+        prefix.
+
+        The session keeps the subtree for each length of its prefix, so
+        this tree must not change while the session is used.
+        """
+        return _TreeSession(self)
+
+    def autocomplete_many(self, prefixes: List[List],
+                          limit: Optional[int] = None) -> \
+            List[List[Tuple[Any, float]]]:
+        """Return the result of autocomplete(prefix, limit) for each prefix
+        in <prefixes>, in the same order.
 
-        return len(common_prefix) == len(prefix)
+        The prefixes are followed in sorted order, each starting from the
+        deepest tree whose value it shares with the previous one, and the
+        matches in each tree are found only once, however many prefixes
+        end in that tree's value or along the edge to it.
+
+        Precondition: limit is None or limit > 0.
+        """
+        results = [[] for _ in prefixes]
+        if self.is_empty():
+            return results
+        # path holds the trees whose values are prefixes of the previous
+        # prefix, from this tree on.
+        path = [self]
+        last_prefix = []
+        matches = {}
+        for i in sorted(range(len(prefixes)), key=prefixes.__getitem__):
+            prefix = prefixes[i]
+            common_length = _common_length(prefix, last_prefix)
+            while len(path) > 1 and path[-1]._length > common_length:
+                path.pop()
+            last_prefix = prefix
+            if (_common_length(prefix, self._key, 0, self._length)
+                    < min(self._length, len(prefix))):
+                continue
+
+            tree = path[-1]
+            while tree is not None and tree._length < len(prefix):
+                subtree = tree._children.get(prefix[tree._length])
+                if subtree is not None:
+                    length = _common_length(prefix, subtree._key,
+                                            tree._length + 1,
+                                            subtree._length)
+                    if length < len(prefix) and length < subtree._length:
+                        subtree = None
+                    elif subtree._length <= len(prefix):
+                        path.append(subtree)
+                tree = subtree
+            if tree is not None:
+                results[i] = _shared_matches(matches, tree, limit)
+        return results
 
     def _leaf_value_weight(self, limit: Optional[int] = None) -> \
             List[Tuple[Any, float]]:
-        """Return a list of tuple consisting of each leaf's value and weight.
+        """Return a list of tuple consisting of up to <limit> leaves' value
+        and weight, for the heaviest leaves in this tree, in non-increasing
+        order of weight.
         """
-        if self.is_empty():
-            return []
-        elif self.is_leaf():
-            return [(self.value, self.weight)]
-        else:
-            leaf_list = []
-            for subtree in self.subtrees:
-                if limit is None:
-                    leaf_list.extend(subtree._leaf_value_weight())
-                elif len(leaf_list) < limit:
-                    leaf_list.extend(subtree._leaf_value_weight(limit -
-                                                                len(leaf_list)))
-                else:
-                    break
-            return sorted(leaf_list, key=lambda x: x[1], reverse=True)
+        cache_size = self._info.cache_size
+        if limit is not None and limit <= cache_size:
+            if self._top_leaves is None:
+                self._top_leaves = _heaviest_leaves(self, cache_size)
+            return self._top_leaves[:limit]
+        return _heaviest_leaves(self, limit)
 
     def remove(self, prefix: List) -> None:
         """Remove all values that match the given prefix.
         """
-        if self.value != []:
-            self._add_head()
-        self._remove(prefix)
-        self._remove_head()
+        common_length = _common_length(prefix, self._key, 0, self._length)
+        if common_length == len(prefix):
+            # Every value in this tree matches <prefix>.
+            self._set_prefix((), 0)
+            self.subtrees = []
+            self._by_max_leaf = None
+            self._children = {}
+            self._info.leaf_index.clear()
+            self._leaf_sum = 0.0
+            self._leaf_count = 0
+            self._max_leaf = 0.0
+            self._top_leaves = None
+            self.weight = 0.0
+        elif common_length == self._length:
+            self._remove(prefix)
+            if self.is_empty():
+                self._set_prefix((), 0)
+            else:
+                self._merge_root()
 
     def _remove(self, prefix: List) -> None:
         """Helper function of remove.
+
+        Precondition: self.value is a proper prefix of <prefix>.
         """
-        if self.is_empty():
-            pass
-        elif self.is_leaf():
-            pass
+        # path holds the trees whose values are proper prefixes of <prefix>,
+        # from shortest to longest.
+        path = [self]
+        while True:
+            tree = path[-1]
+            subtree = tree._children.get(prefix[tree._length])
+            if subtree is None:
+                return
+            length = _common_length(prefix, subtree._key, tree._length + 1,
+                                    subtree._length)
+            if length == len(prefix):
+                break
+            elif length < subtree._length:
+                return
+            path.append(subtree)
+
+        removed_tree = subtree
+        for leaf in removed_tree._leaves():
+            _unindex_leaf(self._info.leaf_index, leaf)
+
+        changed_subtree = removed_tree
+        changed_weight = removed_tree.weight
+        changed_max_leaf = removed_tree._max_leaf
+        for tree in reversed(path):
+            tree_weight = tree.weight
+            tree_max_leaf = tree._max_leaf
+            tree._leaf_sum -= removed_tree._leaf_sum
+            tree._leaf_count -= removed_tree._leaf_count
+            if tree._leaf_count == 0:
+                tree._leaf_sum = 0.0
+            tree.weight = tree._cal_weight()
+            tree._top_leaves = None
+
+            element = changed_subtree._key[tree._length]
+            if changed_subtree is removed_tree or changed_subtree.is_empty():
+                del tree._children[element]
+                _remove_subtree(tree, changed_subtree, changed_weight,
+                                changed_max_leaf)
+            else:
+                if (len(changed_subtree.subtrees) == 1
+                        and not changed_subtree.subtrees[0].is_leaf()):
+                    # changed_subtree is now compressible, so its only
+                    # subtree takes its place in both orders, and its _order.
+                    subtree = changed_subtree.subtrees[0]
+                    tree.subtrees[_subtree_position(
+                        tree.subtrees, changed_subtree,
+                        changed_weight)] = subtree
+                    if tree._by_max_leaf is not None:
+                        tree._by_max_leaf[_subtree_position(
+                            tree._by_max_leaf, changed_subtree,
+                            changed_max_leaf, '_max_leaf')] = subtree
+                    subtree._order = changed_subtree._order
+                    changed_subtree = subtree
+                    tree._children[element] = changed_subtree
+                _reorder_subtree(tree, changed_subtree, changed_weight,
+                                 changed_max_leaf)
+            changed_subtree = tree
+            changed_weight = tree_weight
+            changed_max_leaf = tree_max_leaf
 
-        elif prefix == []:
-            self.subtrees = []
-            self.weight = 0.0
-            self._leaf_count = 0
-            self._leaf_sum = 0.0
 
-        elif self._recursive_subtree_with_prefix(prefix) is None:
-            pass
+################################################################################
+# CompiledAutocompleter
+################################################################################
+class CompiledAutocompleter(Autocompleter):
+    """A read-only autocompleter built from a SimplePrefixTree or a
+    CompressedPrefixTree.
+
+    The tree is stored in a few flat arrays instead of one object per node,
+    which makes it much smaller and faster to search. Nothing can be inserted
+    into or removed from it: insert and remove raise TypeError.
+
+    Chains of non-leaf trees with one subtree are stored as one node, as in
+    a CompressedPrefixTree. The nodes are numbered in breadth-first order,
+    visiting the subtrees of each node in non-increasing order of their
+    heaviest leaf, with ties broken as in the tree. So the children of node
+    n are the nodes _first_child[n] to _first_child[n + 1] - 1 in that
+    order, and node 0 is the root.
+
+    Each prefix element is stored as a *token*: the position of that element
+    in the order the elements were first seen.
+
+    A CompiledAutocompleter can be turned back into a prefix tree with thaw,
+    and written to a file with save and read back with load. The loaded
+    arrays are views into the memory-mapped file, so only the parts of it
+    that queries touch are ever read from disk, and each value is unpickled
+    when a query first returns it.
 
-        elif (len(prefix) == len(self._common_prefix(prefix)[0]) or
-              prefix == self._common_prefix(prefix)[1].value):
-            common_subtree = self._common_prefix(prefix)[1]
-            self.subtrees.remove(common_subtree)
-            self._leaf_sum -= common_subtree._leaf_sum
-            self._leaf_count -= common_subtree._leaf_count
-            self.weight = self._cal_weight()
+    === Attributes ===
+    weight_type:
+        The way that the aggregate weight of non-leaf trees was calculated.
+    """
+    weight_type: str
+    # === Private Attributes ===
+    # _tokens maps each prefix element in the tree to its token.
+    _tokens: Dict[Any, int]
+    # _first_child[n] is the number of the first child of node n.
+    _first_child: array
+    # _by_weight[_first_child[n]:_first_child[n + 1]] are the children of
+    # node n in the order of the subtrees of the tree they were compiled
+    # from, which is non-increasing order of weight. _by_weight[0] is 0, the
+    # root.
+    _by_weight: array
+    # _order[n] is the _order of the tree that node n was compiled from, so
+    # that a thawed tree breaks ties between its subtrees as that tree did.
+    _order: array
+    # _labels[_label_start[n]:_label_start[n + 1]] are the tokens that are
+    # in the value of non-leaf node n but not in its parent's value.
+    _label_start: array
+    _labels: array
+    # _label_text holds the elements of _labels, in the same positions, if
+    # every element is a one-character string, or is None otherwise.
+    _label_text: Optional[str]
+    # _token_child[_token_start[n]:_token_start[n + 1]] are the non-leaf
+    # children of node n, in increasing order of the first token of their
+    # labels, which are stored in the same positions of _first_tokens.
+    _token_start: array
+    _token_child: array
+    _first_tokens: array
+    # _weights[n] is the weight of node n, and _max_leaf[n] is the largest
+    # weight of a leaf in it.
+    _weights: array
+    _max_leaf: array
+    # _value_index[n] is the position in _values of the value of leaf n, or
+    # -1 if node n is not a leaf.
+    _value_index: array
+    _values: Sequence[Any]
+
+    __slots__ = ('weight_type', '_tokens', '_first_child', '_by_weight',
+                 '_order', '_label_start', '_labels', '_label_text',
+                 '_token_start', '_token_child', '_first_tokens', '_weights',
+                 '_max_leaf', '_value_index', '_values')
+
+    def __init__(self, tree: Autocompleter) -> None:
+        """Initialize a compiled copy of <tree>.
+
+        Precondition: <tree> is a SimplePrefixTree or a CompressedPrefixTree.
+        """
+        self.weight_type = tree.weight_type
+        self._tokens = {}
+        self._first_child = array('i')
+        self._by_weight = array('i', [0])
+        self._order = array('q')
+        self._label_start = array('i')
+        self._labels = array('i')
+        self._token_start = array('i')
+        self._token_child = array('i')
+        self._first_tokens = array('i')
+        self._weights = array('d')
+        self._max_leaf = array('d')
+        self._value_index = array('i')
+        self._values = []
+
+        label_elements = []
+        with _gc_paused():
+            # queue holds each node with the length of its parent's value.
+            queue = deque([(tree, 0)])
+            next_node = 1
+            while queue:
+                node, parent_length = queue.popleft()
+                self._weights.append(node.weight)
+                self._max_leaf.append(node._max_leaf)
+                self._order.append(node._order)
+                self._first_child.append(next_node)
+                self._label_start.append(len(self._labels))
+                self._token_start.append(len(self._token_child))
+
+                if node.subtrees == [] and node.weight > 0:
+                    self._value_index.append(len(self._values))
+                    self._values.append(node.value)
+                    continue
+                self._value_index.append(-1)
+
+                label = _edge_label(node, parent_length)
+                length = parent_length + len(label)
+                # Like a CompressedPrefixTree, a non-leaf tree whose only
+                # subtree is not a leaf is stored as one node with a longer
+                # label.
+                while len(node.subtrees) == 1 and \
+                        node.subtrees[0].subtrees != []:
+                    node = node.subtrees[0]
+                    child_label = _edge_label(node, length)
+                    label.extend(child_label)
+                    length += len(child_label)
+                for element in label:
+                    self._labels.append(
+                        self._tokens.setdefault(element, len(self._tokens)))
+                label_elements.extend(label)
+
+                children = []
+                numbers = {}
+                for subtree in _subtrees_by_max_leaf(node):
+                    if subtree.subtrees != []:
+                        first = _edge_label(subtree, length)[0]
+                        children.append((self._tokens.setdefault(
+                            first, len(self._tokens)), next_node))
+                    queue.append((subtree, length))
+                    numbers[id(subtree)] = next_node
+                    next_node += 1
+                self._by_weight.extend(
+                    numbers[id(subtree)] for subtree in node.subtrees)
+                children.sort()
+                for first_token, child in children:
+                    self._first_tokens.append(first_token)
+                    self._token_child.append(child)
+
+        self._first_child.append(next_node)
+        self._label_start.append(len(self._labels))
+        self._token_start.append(len(self._token_child))
+        self._label_text = _pack_key(label_elements)
+        if not isinstance(self._label_text, str):
+            self._label_text = None
 
-        else:
-            subtree_with_prefix = self._recursive_subtree_with_prefix(prefix)
-            self._leaf_sum -= subtree_with_prefix._leaf_sum
-            self._leaf_count -= subtree_with_prefix._leaf_count
-            self.weight = self._cal_weight()
-            common_subtree = self._common_prefix(prefix)[1]
-            common_subtree._remove(prefix)
+    def __len__(self) -> int:
+        """Return the number of values stored in this CompiledAutocompleter.
+        """
+        return len(self._values)
 
-        self._compress(prefix)
+    def thaw(self, tree_class: type, cache_size: int = 0) -> Autocompleter:
+        """Return a new prefix tree of class <tree_class> storing the same
+        values as this CompiledAutocompleter, as if each had been inserted in
+        turn into tree_class(self.weight_type, cache_size).
 
-        self._remove_empty_subtree(prefix)
-        self.subtrees.sort(reverse=True)
+        The nodes already hold the weights and the order of the subtrees of
+        each tree, so the tree is built by visiting them in order: unlike
+        bulk_load, this sorts nothing and builds no prefix for a leaf.
 
-    def _remove_head(self) -> None:
-        """Remove the head of the head list which is empty if it only has one
-        subtree.
+        Precondition: tree_class is SimplePrefixTree or CompressedPrefixTree.
+                      cache_size >= 0.
         """
-        if self.value == [] and len(self.subtrees) == 1:
-            self.value = self.subtrees[0].value
-            self.subtrees = self.subtrees[0].subtrees
+        tree = tree_class(self.weight_type, cache_size)
+        if self._weights[0] == 0.0:
+            return tree
+        # The arrays may be views into a file, which are slow to index.
+        first_child = self._first_child.tolist()
+        by_weight = self._by_weight.tolist()
+        order = self._order.tolist()
+        label_start = self._label_start.tolist()
+        weights = self._weights.tolist()
+        max_leaf = self._max_leaf.tolist()
+        value_index = self._value_index.tolist()
+        labels = self._label_text
+        if labels is None:
+            elements = [None] * len(self._tokens)
+            for element, token in self._tokens.items():
+                elements[token] = element
+            labels = tuple(map(elements.__getitem__, self._labels))
+        leaf_counts, leaf_sums = _leaf_totals(first_child, weights)
+        # The new trees added below come after every tree in this one.
+        tree._info.node_count = max(order) + 1
+
+        with _gc_paused():
+            # trees[n] is the tree that the subtrees of node n are added to.
+            # In a SimplePrefixTree, node n stands for a chain of trees, and
+            # that is the last of them.
+            trees = [tree] + [None] * (len(weights) - 1)
+            tree.weight = weights[0]
+            tree._max_leaf = max_leaf[0]
+            tree._leaf_sum = leaf_sums[0]
+            tree._leaf_count = leaf_counts[0]
+            label = labels[label_start[0]:label_start[1]]
+            if len(label) > 0 and isinstance(tree, SimplePrefixTree):
+                trees[0] = _add_thawed_subtree(tree, label, (
+                    weights[0], max_leaf[0], leaf_sums[0], leaf_counts[0]))
+            elif len(label) > 0:
+                tree._set_prefix(_pack_key(list(label)), len(label))
+
+            for node in range(len(weights)):
+                start, end = first_child[node], first_child[node + 1]
+                if start == end:
+                    continue
+                parent = trees[node]
+                by_max_leaf = [None] * (end - start)
+                for child in by_weight[start:end]:
+                    if value_index[child] >= 0:
+                        leaf = tree._new_subtree()
+                        leaf.value = self._values[value_index[child]]
+                        leaf.weight = weights[child]
+                        leaf._max_leaf = weights[child]
+                        parent.subtrees.append(leaf)
+                        _index_leaf(tree._info.leaf_index, leaf)
+                    else:
+                        trees[child] = _add_thawed_subtree(parent, labels[
+                            label_start[child]:label_start[child + 1]], (
+                            weights[child], max_leaf[child], leaf_sums[child],
+                            leaf_counts[child]))
+                    parent.subtrees[-1]._order = order[child]
+                    by_max_leaf[child - start] = parent.subtrees[-1]
+                if end - start > 1:
+                    parent._by_max_leaf = by_max_leaf
+        return tree
+
+    def save(self, path: str, tag: Any = None) -> None:
+        """Write this CompiledAutocompleter to the file at <path>, with
+        <tag>, any picklable object, which load_tag returns.
+
+        The file holds the header and the hash of the file, then the pickled
+        tag, each of the arrays, the pickled values and the pickled tokens,
+        each starting at a multiple of 8 bytes.
+        """
+        value_offsets = array('q', [0])
+        pickled_values = []
+        for i in range(len(self._values)):
+            pickled_values.append(pickle.dumps(self._values[i]))
+            value_offsets.append(value_offsets[-1] + len(pickled_values[-1]))
+        tokens = [None] * len(self._tokens)
+        for element, token in self._tokens.items():
+            tokens[token] = element
+        pickled_tokens = pickle.dumps((self.weight_type, tokens,
+                                       self._label_text))
+        pickled_tag = pickle.dumps(tag)
+
+        head = _SNAPSHOT_MAGIC + _SNAPSHOT_HEADER.pack(
+            sys.byteorder[0].encode(), len(self._weights), len(self._labels),
+            len(self._token_child), len(self._values), value_offsets[-1],
+            len(pickled_tokens), len(pickled_tag))
+        digest = hashlib.sha256(head)
+        sections = []
+        for section in (pickled_tag, self._first_child, self._by_weight,
+                        self._order, self._label_start, self._labels,
+                        self._token_start, self._token_child,
+                        self._first_tokens, self._weights, self._max_leaf,
+                        self._value_index, value_offsets,
+                        b''.join(pickled_values), pickled_tokens):
+            data = bytes(section)
+            sections.append(data + bytes(-len(data) % 8))
+            digest.update(sections[-1])
+        with open(path, 'wb') as file:
+            file.write(head)
+            file.write(digest.digest())
+            file.writelines(sections)
+
+    @staticmethod
+    def load_tag(path: str) -> Any:
+        """Return the tag saved with the CompiledAutocompleter in the file at
+        <path>, without loading the rest of the file.
+
+        Raise ValueError if <path> is not a file written by save on a
+        machine with the same byte order as this one.
+        """
+        data, header = _map_snapshot(path)
+        sections = _SnapshotSections(memoryview(data), _SNAPSHOT_SECTIONS)
+        return pickle.loads(sections.next('B', header[-1]))
+
+    @classmethod
+    def load(cls, path: str, check: bool = False) -> CompiledAutocompleter:
+        """Return the CompiledAutocompleter saved in the file at <path>.
+
+        The file is memory-mapped rather than read, so loading takes about
+        the same time however large the file is. If <check> is True, the
+        whole file is read once to check its hash, since a damaged file
+        could make queries read past the end of an array, or loop forever.
+
+        Raise ValueError if <path> is not a file written by save on a
+        machine with the same byte order as this one, or if <check> is True
+        and the file has changed since it was written.
+        """
+        data, header = _map_snapshot(path)
+        nodes, labels, children, values, value_bytes, token_bytes, \
+            tag_bytes = header
+        view = memoryview(data)
+        if check:
+            digest = hashlib.sha256(view[:_SNAPSHOT_DIGEST])
+            digest.update(view[_SNAPSHOT_SECTIONS:])
+            if digest.digest() != view[_SNAPSHOT_DIGEST:_SNAPSHOT_SECTIONS]:
+                raise ValueError(f'{path} is damaged')
+
+        compiled = cls.__new__(cls)
+        sections = _SnapshotSections(view, _SNAPSHOT_SECTIONS)
+        sections.next('B', tag_bytes)
+        compiled._first_child = sections.next('i', nodes + 1)
+        compiled._by_weight = sections.next('i', nodes)
+        compiled._order = sections.next('q', nodes)
+        compiled._label_start = sections.next('i', nodes + 1)
+        compiled._labels = sections.next('i', labels)
+        compiled._token_start = sections.next('i', nodes + 1)
+        compiled._token_child = sections.next('i', children)
+        compiled._first_tokens = sections.next('i', children)
+        compiled._weights = sections.next('d', nodes)
+        compiled._max_leaf = sections.next('d', nodes)
+        compiled._value_index = sections.next('i', nodes)
+        compiled._values = _SnapshotValues(sections.next('q', values + 1),
+                                           sections.next('B', value_bytes))
+        compiled.weight_type, tokens, compiled._label_text = pickle.loads(
+            sections.next('B', token_bytes))
+        compiled._tokens = {element: token
+                            for token, element in enumerate(tokens)}
+        return compiled
+
+    def insert(self, value: Any, weight: float, prefix: List) -> None:
+        """Raise TypeError, since a CompiledAutocompleter is read-only."""
+        raise TypeError('a CompiledAutocompleter is read-only')
 
-    def _compress(self, prefix: list) -> None:
-        """Compress the tree so that all trees has more than one child or it is
-        the parent of a leaf (or both).
+    def remove(self, prefix: List) -> None:
+        """Raise TypeError, since a CompiledAutocompleter is read-only."""
+        raise TypeError('a CompiledAutocompleter is read-only')
+
+    def autocomplete(self, prefix: List,
+                     limit: Optional[int] = None) -> List[Tuple[Any, float]]:
+        """Return up to <limit> matches for the given prefix.
+
+        The return value is a list of tuples (value, weight), and must be
+        ordered in non-increasing weight. (You can decide how to break ties.)
+
+        If limit is None, return *every* match for the given prefix.
+
+        Precondition: limit is None or limit > 0.
         """
-        if self.is_empty():
-            pass
-        elif self.is_leaf():
-            pass
-        elif self._subtree_compressible(prefix) is not None:
-            compressible = self._subtree_compressible(prefix)
-            self.subtrees.remove(compressible)
-            self.subtrees.append(compressible.subtrees[0])
-        else:
-            for subtree in self.subtrees:
-                length = min(len(prefix), len(subtree.value))
-                if prefix[:length] != subtree.value[:length]:
-                    continue
-                else:
-                    subtree._compress(prefix)
+        if self._weights[0] == 0.0:
+            return []
+        node = self._node_with_prefix(prefix)
+        if node is None:
+            return []
+        return list(islice(self._iter_heaviest_leaves(node), limit))
+
+    def iter_autocomplete(self, prefix: List) -> Iterator[Tuple[Any, float]]:
+        """Return an iterator over every match for the given prefix, as
+        tuples (value, weight) in non-increasing order of weight.
 
-    def _subtree_compressible(self, prefix: list) \
-            -> Optional[CompressedPrefixTree]:
-        """Return the subtree which is compressible.
-        If there is none, return None.
+        Each match is found as it is taken from the iterator, so taking the
+        first n matches costs about as much as autocomplete(prefix, n).
         """
-        for subtree in self.subtrees:
-            length = min(len(prefix), len(subtree.value))
-            if prefix[:length] != subtree.value[:length]:
-                continue
+        if self._weights[0] == 0.0:
+            return iter([])
+        node = self._node_with_prefix(prefix)
+        if node is None:
+            return iter([])
+        return self._iter_heaviest_leaves(node)
+
+    def _node_with_prefix(self, prefix: List) -> Optional[int]:
+        """Return the node with the shortest value that starts with
+        <prefix>, or None if there is no such node.
+        """
+        tokens = []
+        for element in prefix:
+            token = self._tokens.get(element)
+            if token is None:
+                return None
+            tokens.append(token)
+
+        labels = self._labels
+        label_start = self._label_start
+        node = 0
+        position = 0
+        while True:
+            for i in range(label_start[node], label_start[node + 1]):
+                if position == len(tokens):
+                    return node
+                if labels[i] != tokens[position]:
+                    return None
+                position += 1
+            if position == len(tokens):
+                return node
+
+            start = self._token_start[node]
+            end = self._token_start[node + 1]
+            i = bisect_left(self._first_tokens, tokens[position], start, end)
+            if i == end or self._first_tokens[i] != tokens[position]:
+                return None
+            node = self._token_child[i]
+
+    def _iter_heaviest_leaves(self, node: int) -> \
+            Iterator[Tuple[Any, float]]:
+        """Yield (value, weight) tuples for the leaves of <node>, in
+        non-increasing order of weight.
+
+        The search is best-first, as in the _iter_heaviest_leaves helper
+        function.
+        Since siblings are in non-increasing order of their heaviest leaf, a
+        node is only added to the heap once its previous sibling is taken
+        from it. The heap holds (-_max_leaf[n], n, e) for each node n, where
+        e is the number after its last sibling.
+        """
+        first_child = self._first_child
+        max_leaf = self._max_leaf
+        heap = [(-max_leaf[node], node, node + 1)]
+        while heap:
+            _, node, end = heapq.heappop(heap)
+            if node + 1 < end:
+                heapq.heappush(heap, (-max_leaf[node + 1], node + 1, end))
+
+            start, end = first_child[node], first_child[node + 1]
+            # A lone child has the same _max_leaf, so it needs no heap entry.
+            while end - start == 1:
+                node = start
+                start, end = first_child[node], first_child[node + 1]
+            if start < end:
+                heapq.heappush(heap, (-max_leaf[start], start, end))
             else:
-                num_subtree = len(subtree.subtrees)
-                if num_subtree == 1:
-                    if not subtree.subtrees[0].is_leaf():
-                        return subtree
-        return None
+                if self._value_index[node] >= 0:
+                    yield (self._values[self._value_index[node]],
+                           self._weights[node])
+
+
+################################################################################
+# ShardedAutocompleter
+################################################################################
+class ShardedAutocompleter(Autocompleter):
+    """An autocompleter that divides its values among several
+    CompressedPrefixTrees, its *shards*.
+
+    Each value is stored in the shard given by a hash of the first
+    key_length elements of its prefix sequence, so a prefix of at least
+    that length can only match values in one shard. Shorter prefixes are
+    looked up in every shard, and the matches from each are merged.
 
-    def _remove_empty_subtree(self, prefix: list) -> None:
-        """Remove all empty subtrees in this tree.
+    The shards can be kept in this process, or each run in its own worker
+    process, which is sent each request through a pipe. Worker processes
+    answer a request sent to several shards at the same time; call close
+    to stop them once this autocompleter is no longer needed.
+
+    === Attributes ===
+    weight_type:
+        The way that the aggregate weight of non-leaf trees should be
+        calculated.
+    """
+    weight_type: str
+    # === Private Attributes ===
+    # _shards holds the shards, or if they run in worker processes, the
+    # connections through which they are sent requests.
+    _shards: List[Any]
+    # _processes holds the worker processes, or is None if the shards are in
+    # this process.
+    _processes: Optional[List[multiprocessing.Process]]
+    _key_length: int
+
+    __slots__ = ('weight_type', '_shards', '_processes', '_key_length')
+
+    def __init__(self, weight_type: str, cache_size: int = 0,
+                 shard_count: int = 4, key_length: int = 1,
+                 processes: bool = False) -> None:
+        """Initialize an empty autocompleter with <shard_count> shards.
+
+        Precondition: weight_type == 'sum' or weight_type == 'average'.
+                      cache_size >= 0.
+                      shard_count >= 1 and key_length >= 1.
+
+        <weight_type> and <cache_size> are used for each shard, as in the
+        CompressedPrefixTree initializer. If <processes> is True, each shard
+        runs in its own worker process.
         """
-        if self.is_empty():
-            pass
-        elif self.is_leaf():
-            pass
-        elif self._zero_weight_subtree() is not None:
-            self.subtrees.remove(self._zero_weight_subtree())
-        else:
-            for subtree in self.subtrees:
-                length = min(len(prefix), len(subtree.value))
-                if prefix[:length] != subtree.value[:length]:
-                    continue
-                else:
-                    subtree._remove_empty_subtree(prefix)
+        self.weight_type = weight_type
+        self._shards = []
+        self._processes = [] if processes else None
+        self._key_length = key_length
+        for _ in range(shard_count):
+            self._add_shard([], cache_size)
+
+    @classmethod
+    def bulk_load(cls, items: Iterable[Tuple[Any, float, List]],
+                  weight_type: str, cache_size: int = 0,
+                  shard_count: int = 4, key_length: int = 1,
+                  processes: bool = False) -> ShardedAutocompleter:
+        """Return a new ShardedAutocompleter storing every (value, weight,
+        prefix) tuple in <items>, as if each had been inserted in turn into
+        ShardedAutocompleter(weight_type, cache_size, shard_count,
+        key_length, processes).
+
+        Each shard is built with CompressedPrefixTree.bulk_load, in its
+        worker process if there is one.
+
+        Preconditions: the preconditions of __init__ and of insert, for each
+        tuple in <items>.
+        """
+        parts = [[] for _ in range(shard_count)]
+        for item in items:
+            parts[_shard_of(item[2], key_length, shard_count)].append(item)
+        sharded = cls(weight_type, cache_size, 0, key_length, processes)
+        for part in parts:
+            sharded._add_shard(part, cache_size)
+        return sharded
+
+    def _add_shard(self, items: List[Tuple[Any, float, List]],
+                   cache_size: int) -> None:
+        """Add a shard storing the (value, weight, prefix) tuples in <items>.
+        """
+        if self._processes is None:
+            self._shards.append(CompressedPrefixTree.bulk_load(
+                items, self.weight_type, cache_size))
+            return
+        connection, worker_connection = multiprocessing.Pipe()
+        process = multiprocessing.Process(
+            target=_serve_shard,
+            args=(worker_connection, items, self.weight_type, cache_size),
+            daemon=True)
+        process.start()
+        worker_connection.close()
+        self._shards.append(connection)
+        self._processes.append(process)
+
+    def close(self) -> None:
+        """Stop the worker processes of the shards, if they have any.
+
+        No other method may be called afterwards.
+        """
+        if self._processes is None:
+            return
+        for connection in self._shards:
+            connection.send(None)
+            connection.close()
+        for process in self._processes:
+            process.join()
+        self._processes = []
+        self._shards = []
 
-    def _zero_weight_subtree(self) -> Optional[CompressedPrefixTree]:
-        """Return the subtree of this tree whose weight is zero.
-        If there is none, return None instead.
+    def __len__(self) -> int:
+        """Return the number of values stored in this ShardedAutocompleter.
         """
-        for subtree in self.subtrees:
-            if subtree.weight == 0.0:
-                return subtree
-        return None
+        return sum(self._call_shards(self._shards, '__len__'))
 
-    def _recursive_subtree_with_prefix(self, prefix: list) -> \
-            Optional[CompressedPrefixTree]:
-        """Return a SimplePrefixTree if the subtrees of self's value is the same
-        with prefix.
+    def insert(self, value: Any, weight: float, prefix: List) -> None:
+        """Insert the given value into this ShardedAutocompleter.
+
+        The value is inserted with the given weight, and is associated with
+        the prefix sequence <prefix>.
+
+        If the value has already been inserted into this prefix tree
+        (compare values using ==), then the given weight should be *added* to
+        the existing weight of this value.
+
+        Preconditions:
+            weight > 0
+            The given value is either:
+                1) not in this Autocompleter
+                2) was previously inserted with the SAME prefix sequence
         """
-        if self.is_empty():
-            return None
-        elif self.is_leaf():
-            return None
-        elif not self._common_prefix(prefix):
-            return None
+        shard = self._shards[_shard_of(prefix, self._key_length,
+                                       len(self._shards))]
+        self._call_shards([shard], 'insert', value, weight, prefix)
+
+    def autocomplete(self, prefix: List,
+                     limit: Optional[int] = None) -> List[Tuple[Any, float]]:
+        """Return up to <limit> matches for the given prefix.
+
+        The return value is a list of tuples (value, weight), and must be
+        ordered in non-increasing weight. (You can decide how to break ties.)
+
+        If limit is None, return *every* match for the given prefix.
+
+        Precondition: limit is None or limit > 0.
+        """
+        results = self._call_shards(self._shards_for(prefix), 'autocomplete',
+                                    prefix, limit)
+        if len(results) == 1:
+            return results[0]
+        # Each shard's matches are sorted, so only the first <limit> of all
+        # of them merged in order are needed.
+        matches = heapq.merge(*results, key=lambda match: -match[1])
+        return list(islice(matches, limit))
+
+    def remove(self, prefix: List) -> None:
+        """Remove all values that match the given prefix.
+        """
+        self._call_shards(self._shards_for(prefix), 'remove', prefix)
+
+    def _shards_for(self, prefix: List) -> List[Any]:
+        """Return the shards that may store values that match <prefix>."""
+        if len(prefix) < self._key_length:
+            return self._shards
+        return [self._shards[_shard_of(prefix, self._key_length,
+                                       len(self._shards))]]
+
+    def _call_shards(self, shards: List[Any], method: str,
+                     *args: Any) -> List[Any]:
+        """Return the results of calling the method named <method> with
+        <args> on each of <shards>.
+
+        Shards in worker processes are sent every request before any result
+        is waited for, so that they work at the same time.
+        """
+        if self._processes is None:
+            return [getattr(shard, method)(*args) for shard in shards]
+        for connection in shards:
+            connection.send((method, args))
+        results = []
+        for connection in shards:
+            succeeded, result = connection.recv()
+            if not succeeded:
+                raise result
+            results.append(result)
+        return results
+
+
+################################################################################
+# Autocomplete sessions
+################################################################################
+class AutocompleteSession:
+    """A prefix that is typed into an Autocompleter one element at a time,
+    such as the letters typed into a search box, whose matches can be asked
+    for after each change.
+
+    This class asks the Autocompleter for the matches of the whole prefix
+    each time. Prefix trees return sessions that keep the subtree for each
+    length of the prefix instead, so that each change only costs as much as
+    the elements added or removed.
+
+    === Attributes ===
+    autocompleter:
+        The Autocompleter whose values are matched.
+    prefix:
+        The elements typed so far.
+    """
+    autocompleter: Autocompleter
+    prefix: List
+
+    def __init__(self, autocompleter: Autocompleter) -> None:
+        """Initialize a session with an empty prefix for <autocompleter>."""
+        self.autocompleter = autocompleter
+        self.prefix = []
+
+    def extend(self, elements: Iterable) -> None:
+        """Add <elements> to the end of the prefix."""
+        self.prefix.extend(elements)
+
+    def backspace(self, count: int = 1) -> None:
+        """Remove the last <count> elements of the prefix, or all of them if
+        it has fewer than <count>.
+
+        Precondition: count >= 0.
+        """
+        del self.prefix[max(len(self.prefix) - count, 0):]
+
+    def top(self, limit: Optional[int] = None) -> List[Tuple[Any, float]]:
+        """Return up to <limit> matches for the prefix, as autocomplete
+        does.
+
+        Precondition: limit is None or limit > 0.
+        """
+        return self.autocompleter.autocomplete(self.prefix, limit)
+
+
+class _TreeSession(AutocompleteSession):
+    """An AutocompleteSession for a SimplePrefixTree or a
+    CompressedPrefixTree, which must not change while it is used.
+
+    Typing along a compressed edge, or a chain of subtrees with one subtree
+    each, does not change the matches, so the matches found for the
+    previous length of the prefix are returned again.
+    """
+    # === Private Attributes ===
+    # _trees[i] is the subtree for self.prefix[:i], which is the tree with
+    # the shortest value that starts with it, or None if there is none.
+    _trees: List[Optional[Any]]
+    # _matches[i] is the limit and the matches last returned by top for
+    # self.prefix[:i], or None if top has not been called for it.
+    _matches: List[Optional[Tuple[Optional[int], List[Tuple[Any, float]]]]]
+
+    def __init__(self, tree: Any) -> None:
+        """Initialize a session with an empty prefix for <tree>."""
+        AutocompleteSession.__init__(self, tree)
+        self._trees = [tree]
+        self._matches = [None]
+
+    def extend(self, elements: Iterable) -> None:
+        """Add <elements> to the end of the prefix."""
+        for element in elements:
+            tree = self._trees[-1]
+            if tree is not None:
+                tree = tree._step(len(self.prefix), element)
+            self.prefix.append(element)
+            self._trees.append(tree)
+            self._matches.append(None)
+
+    def backspace(self, count: int = 1) -> None:
+        """Remove the last <count> elements of the prefix, or all of them if
+        it has fewer than <count>.
+
+        Precondition: count >= 0.
+        """
+        length = max(len(self.prefix) - count, 0)
+        del self.prefix[length:]
+        del self._trees[length + 1:]
+        del self._matches[length + 1:]
 
-        elif (len(self._common_prefix(prefix)[0]) <
-              len(self._common_prefix(prefix)[1].value) or
-              prefix == self._common_prefix(prefix)[1].value):
-            return self._common_prefix(prefix)[1]
+    def top(self, limit: Optional[int] = None) -> List[Tuple[Any, float]]:
+        """Return up to <limit> matches for the prefix, as autocomplete
+        does.
+
+        Precondition: limit is None or limit > 0.
+        """
+        length = len(self.prefix)
+        tree = self._trees[length]
+        if tree is None or tree.is_empty():
+            return []
+        matches = self._matches[length]
+        if matches is None and length > 0:
+            parent = self._trees[length - 1]
+            if parent is tree or (len(parent.subtrees) == 1
+                                  and parent.subtrees[0] is tree):
+                matches = self._matches[length - 1]
+        if matches is None or matches[0] != limit:
+            matches = (limit, tree._leaf_value_weight(limit))
+        self._matches[length] = matches
+        return list(matches[1])
+
+
+################################################################################
+# Helper functions
+################################################################################
+class _TreeInfo:
+    """The state shared by every node of one prefix tree, so that each node
+    refers to it instead of holding its own copy.
+
+    === Attributes ===
+    weight_type:
+        The way that the aggregate weight of non-leaf trees should be
+        calculated.
+    cal_weight:
+        The function that calculates the aggregate weight of a node, given
+        that node.
+    cache_size:
+        The number of heaviest leaves cached by each non-leaf node, or 0 if
+        caching is off.
+    leaf_index:
+        A dict mapping each value stored in the tree to its leaf.
+    node_count:
+        The number of nodes that have been added to the tree.
+    """
+    weight_type: str
+    cal_weight: Callable[[Any], float]
+    cache_size: int
+    leaf_index: Dict[Any, Any]
+    node_count: int
+
+    __slots__ = ('weight_type', 'cal_weight', 'cache_size', 'leaf_index',
+                 'node_count')
+
+    def __init__(self, weight_type: str, cal_weight: Callable[[Any], float],
+                 cache_size: int) -> None:
+        """Initialize the shared state of an empty prefix tree."""
+        self.weight_type = weight_type
+        self.cal_weight = cal_weight
+        self.cache_size = cache_size
+        self.leaf_index = {}
+        self.node_count = 0
+
+
+class _SnapshotSections:
+    """The consecutive sections of a file written by
+    CompiledAutocompleter.save, read in order.
+    """
+    # === Private Attributes ===
+    # _data is the whole file, and _offset is where the next section starts.
+    _data: memoryview
+    _offset: int
+
+    __slots__ = ('_data', '_offset')
+
+    def __init__(self, data: memoryview, offset: int) -> None:
+        """Initialize the sections of <data> that start at <offset>."""
+        self._data = data
+        self._offset = offset
+
+    def next(self, typecode: str, length: int) -> memoryview:
+        """Return a view of the next section as <length> items of the array
+        type <typecode>.
+        """
+        size = struct.calcsize(typecode) * length
+        section = self._data[self._offset:self._offset + size].cast(typecode)
+        self._offset += size + -size % 8
+        return section
+
+
+class _SnapshotValues(Sequence):
+    """The values of a CompiledAutocompleter loaded from a file, each of
+    which is unpickled when it is accessed.
+    """
+    # === Private Attributes ===
+    # The pickled value at position i is _data[_offsets[i]:_offsets[i + 1]].
+    _offsets: memoryview
+    _data: memoryview
+
+    __slots__ = ('_offsets', '_data')
+
+    def __init__(self, offsets: memoryview, data: memoryview) -> None:
+        """Initialize the values pickled in <data> at <offsets>."""
+        self._offsets = offsets
+        self._data = data
+
+    def __len__(self) -> int:
+        """Return the number of values."""
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index: int) -> Any:
+        """Return the value at position <index>."""
+        if not 0 <= index < len(self):
+            raise IndexError('value index out of range')
+        return pickle.loads(
+            self._data[self._offsets[index]:self._offsets[index + 1]])
+
+
+def _map_snapshot(path: str) -> Tuple[mmap.mmap, Tuple[int, ...]]:
+    """Return the memory-mapped file at <path>, written by
+    CompiledAutocompleter.save, and the sizes in its header.
+
+    Raise ValueError if <path> is not such a file, written on a machine with
+    the same byte order as this one.
+    """
+    with open(path, 'rb') as file:
+        data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    if data[:len(_SNAPSHOT_MAGIC)] != _SNAPSHOT_MAGIC:
+        raise ValueError(f'{path} is not a prefix tree snapshot')
+    byteorder, *sizes = _SNAPSHOT_HEADER.unpack_from(data,
+                                                    len(_SNAPSHOT_MAGIC))
+    if byteorder != sys.byteorder[0].encode():
+        raise ValueError(f'{path} was saved with a different byte order')
+    return data, tuple(sizes)
+
+
+def _shard_of(prefix: List, key_length: int, shard_count: int) -> int:
+    """Return the number of the shard of a ShardedAutocompleter with
+    <shard_count> shards that stores the values with the prefix sequence
+    <prefix>.
+    """
+    return hash(tuple(prefix[:key_length])) % shard_count
+
+
+def _serve_shard(connection: Any, items: List[Tuple[Any, float, List]],
+                 weight_type: str, cache_size: int) -> None:
+    """Answer the requests sent through <connection> to a shard of a
+    ShardedAutocompleter, which first stores the (value, weight, prefix)
+    tuples in <items>, until None is received.
+
+    Each request is a tuple (method, args), answered with (True, result),
+    or (False, error) if the method raises an error.
+    """
+    tree = CompressedPrefixTree.bulk_load(items, weight_type, cache_size)
+    while True:
+        request = connection.recv()
+        if request is None:
+            break
+        method, args = request
+        try:
+            connection.send((True, getattr(tree, method)(*args)))
+        except Exception as error:
+            connection.send((False, error))
+    connection.close()
+
+
+def _shared_matches(matches: Dict[Any, List[Tuple[Any, float]]], tree: Any,
+                    limit: Optional[int]) -> List[Tuple[Any, float]]:
+    """Return a copy of the up to <limit> heaviest leaves of <tree>, found
+    only if <tree> is not already a key of <matches>, and stored there.
+    """
+    if tree not in matches:
+        matches[tree] = tree._leaf_value_weight(limit)
+    return list(matches[tree])
+
+
+def _reorder_subtree(tree: Any, subtree: Any, old_weight: float,
+                     old_max_leaf: float) -> None:
+    """Move <subtree>, whose weight and _max_leaf have just changed from
+    <old_weight> and <old_max_leaf>, to its place in tree.subtrees and
+    tree._by_max_leaf, and update tree._max_leaf.
+
+    If <old_weight> is 0.0, <subtree> was just added to the end of
+    tree.subtrees.
+    """
+    _move_subtree(tree.subtrees, subtree, old_weight, 'weight')
+    if tree._by_max_leaf is not None:
+        if old_weight == 0.0:
+            tree._by_max_leaf.append(subtree)
+        _move_subtree(tree._by_max_leaf, subtree, old_max_leaf, '_max_leaf')
+    elif len(tree.subtrees) > 1:
+        # <subtree> is the second subtree of tree.
+        tree._by_max_leaf = list(tree.subtrees)
+        _sort_subtrees(tree._by_max_leaf, '_max_leaf')
+    tree._max_leaf = _subtrees_by_max_leaf(tree)[0]._max_leaf
+
+
+def _remove_subtree(tree: Any, subtree: Any, weight: float,
+                    max_leaf: float) -> None:
+    """Remove <subtree>, whose weight and _max_leaf are <weight> and
+    <max_leaf>, from tree.subtrees and tree._by_max_leaf, and update
+    tree._max_leaf.
+    """
+    del tree.subtrees[_subtree_position(tree.subtrees, subtree, weight)]
+    if tree._by_max_leaf is not None:
+        if len(tree.subtrees) < 2:
+            tree._by_max_leaf = None
         else:
-            for subtree in self.subtrees:
-                length = min(len(prefix), len(subtree.value))
-                if prefix[:length] != subtree.value[:length]:
-                    continue
-                else:
-                    recursive_subtree = subtree.\
-                        _recursive_subtree_with_prefix(prefix)
-                    if recursive_subtree is not None:
-                        return recursive_subtree
-            return None
+            del tree._by_max_leaf[_subtree_position(
+                tree._by_max_leaf, subtree, max_leaf, '_max_leaf')]
+    if tree.subtrees == []:
+        tree._max_leaf = 0.0
+    else:
+        tree._max_leaf = _subtrees_by_max_leaf(tree)[0]._max_leaf
+
+
+def _subtrees_by_max_leaf(tree: Any) -> List[Any]:
+    """Return the subtrees of <tree> in non-increasing order of their
+    _max_leaf, with ties broken by increasing _order.
+    """
+    if tree._by_max_leaf is None:
+        return tree.subtrees
+    return tree._by_max_leaf
+
+
+def _move_subtree(subtrees: List, subtree: Any, old_weight: float,
+                  attribute: str) -> None:
+    """Move <subtree>, whose <attribute> has just changed from <old_weight>,
+    to its place in <subtrees>.
+
+    Precondition: <subtrees> is sorted in non-increasing order of
+    <attribute>, with ties in increasing order of _order, if the <attribute>
+    of <subtree> is taken to be <old_weight>.
+    """
+    index = _subtree_position(subtrees, subtree, old_weight, attribute)
+    weight = getattr(subtree, attribute)
+    if weight > old_weight:
+        # Find the place of subtree in subtrees[:index].
+        new_index = _subtree_position(subtrees, subtree, weight, attribute,
+                                      0, index)
+    else:
+        # Find the place of subtree in subtrees[index + 1:], which move up
+        # one place when it is taken out.
+        new_index = _subtree_position(subtrees, subtree, weight, attribute,
+                                      index + 1) - 1
+    if new_index != index:
+        subtrees.pop(index)
+        subtrees.insert(new_index, subtree)
+
+
+def _subtree_position(subtrees: List, subtree: Any, weight: float,
+                      attribute: str = 'weight', low: int = 0,
+                      high: Optional[int] = None) -> int:
+    """Return the first position in subtrees[low:high] that holds <subtree>,
+    or a subtree that comes after <subtree> if its <attribute> were
+    <weight>, or <high> if there is none. <high> is len(subtrees) if it is
+    None.
+
+    Precondition: apart from <subtree>, <subtrees> is sorted in non-increasing
+    order of <attribute>, with ties in increasing order of _order. If
+    <subtree> is in subtrees[low:high], it is in its place for <weight>.
+    """
+    order = subtree._order
+    if high is None:
+        high = len(subtrees)
+    while low < high:
+        middle = (low + high) // 2
+        other = subtrees[middle]
+        other_weight = getattr(other, attribute)
+        if other is not subtree and (
+                other_weight > weight
+                or (other_weight == weight and other._order < order)):
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+def _sort_subtrees(subtrees: List, attribute: str) -> None:
+    """Sort <subtrees> in non-increasing order of <attribute>, with ties in
+    increasing order of _order.
+    """
+    # Sorting by _order first breaks ties by it, since the sort by
+    # <attribute> is stable.
+    subtrees.sort(key=attrgetter('_order'))
+    subtrees.sort(key=attrgetter(attribute), reverse=True)
+
+
+def _heaviest_leaves(tree: Any, limit: Optional[int]) -> \
+        List[Tuple[Any, float]]:
+    """Return (value, weight) tuples for the up to <limit> heaviest leaves
+    of <tree>, in non-increasing order of weight.
+    """
+    return list(islice(_iter_heaviest_leaves(tree), limit))
+
+
+def _iter_heaviest_leaves(tree: Any) -> Iterator[Tuple[Any, float]]:
+    """Yield (value, weight) tuples for the leaves of <tree>, in
+    non-increasing order of weight.
+
+    The search is best-first: a heap holds subtrees keyed by their _max_leaf,
+    so a subtree is only expanded once it may hold the next heaviest leaf.
+    Since the subtrees of each tree are also kept in non-increasing order of
+    _max_leaf, a subtree is only added to the heap once its previous sibling
+    in that order is taken from it. The heap holds (-s._max_leaf, p, l, i)
+    for each subtree s, where s is l[i], and p is the number of entries
+    pushed before it.
+    """
+    heap = [(-tree._max_leaf, 0, [tree], 0)]
+    pushed = 1
+    while heap:
+        _, _, siblings, index = heapq.heappop(heap)
+        if index + 1 < len(siblings):
+            heapq.heappush(heap, (-siblings[index + 1]._max_leaf, pushed,
+                                  siblings, index + 1))
+            pushed += 1
+        subtree = siblings[index]
+        # A lone subtree has the same _max_leaf, so it needs no heap entry.
+        while len(subtree.subtrees) == 1:
+            subtree = subtree.subtrees[0]
+        if subtree.subtrees == []:
+            if subtree.weight > 0:
+                yield subtree.value, subtree.weight
+        else:
+            children = _subtrees_by_max_leaf(subtree)
+            heapq.heappush(heap, (-children[0]._max_leaf, pushed, children, 0))
+            pushed += 1
+
+
+def _patch_top_leaves(top_leaves: List[Tuple[Any, float]], cache_size: int,
+                      leaf: Any) -> None:
+    """Update <top_leaves>, the cached <cache_size> heaviest leaves of a
+    tree, after <leaf> was added to that tree or its weight increased.
+
+    If fewer than <cache_size> leaves are cached, every leaf of the tree is
+    cached. Otherwise, only a leaf heavier than the lightest cached one can
+    enter the cache.
+    """
+    for i in range(len(top_leaves)):
+        if top_leaves[i][0] == leaf.value:
+            top_leaves.pop(i)
+            break
+    if len(top_leaves) == cache_size and leaf.weight <= top_leaves[-1][1]:
+        return
+
+    i = 0
+    while i < len(top_leaves) and top_leaves[i][1] >= leaf.weight:
+        i += 1
+    top_leaves.insert(i, (leaf.value, leaf.weight))
+    if len(top_leaves) > cache_size:
+        top_leaves.pop()
+
+
+def _update_path(path: List, leaf: Any, weight: float,
+                 old_weight: float) -> None:
+    """Update the trees in <path> after <weight> was added to the weight of
+    <leaf>.
+
+    <path> holds the trees that contain <leaf>, from the root down to its
+    parent. <old_weight> is the weight of <leaf> before, or 0.0 if it was
+    just added to the end of the subtrees of its parent.
+    """
+    is_new = old_weight == 0.0
+    changed_subtree = leaf
+    changed_weight = old_weight
+    changed_max_leaf = old_weight
+    for tree in reversed(path):
+        tree_weight = tree.weight
+        tree_max_leaf = tree._max_leaf
+        if is_new:
+            tree._leaf_count += 1
+        tree._leaf_sum += weight
+        tree.weight = tree._cal_weight()
+        if tree._top_leaves is not None:
+            _patch_top_leaves(tree._top_leaves, tree._info.cache_size, leaf)
+
+        _reorder_subtree(tree, changed_subtree, changed_weight,
+                         changed_max_leaf)
+        changed_subtree = tree
+        changed_weight = tree_weight
+        changed_max_leaf = tree_max_leaf
+
+
+def _merge_leaf(tree: Any, other_leaf: Any) -> None:
+    """Add the weight of <other_leaf>, a leaf of another tree, to the leaf
+    of <tree> with the same value, or add a copy of <other_leaf> to
+    tree.subtrees if there is none.
+
+    Does not update the aggregate weight or the order of tree.subtrees.
+    """
+    try:
+        leaf = tree._info.leaf_index.get(other_leaf.value)
+    except TypeError:
+        # Unhashable values are not indexed; look for them in tree.subtrees.
+        leaf = None
+        for subtree in tree.subtrees:
+            if subtree.is_leaf() and subtree.value == other_leaf.value:
+                leaf = subtree
+                break
+    if leaf is None:
+        tree._add_copy(other_leaf)
+    else:
+        leaf.weight += other_leaf.weight
+        leaf._max_leaf = leaf.weight
+
+
+def _copy_subtree(tree: Any, subtree: Any) -> None:
+    """Add a copy of <subtree>, a subtree of another tree of the same class,
+    to the end of tree.subtrees.
+
+    Does not update the aggregate weight or the order of tree.subtrees.
+    """
+    # stack holds each tree still to be copied, with the copy of its parent.
+    stack = [(tree, subtree)]
+    # copies holds the copies of trees with more than one subtree.
+    copies = []
+    while stack:
+        parent, original = stack.pop()
+        copy = parent._add_copy(original)
+        if len(original.subtrees) > 1:
+            copies.append(copy)
+        for child in reversed(original.subtrees):
+            stack.append((copy, child))
+    for copy in copies:
+        copy._by_max_leaf = list(copy.subtrees)
+        _sort_subtrees(copy._by_max_leaf, '_max_leaf')
+
+
+def _add_thawed_subtree(tree: Any, elements: Sequence,
+                        totals: Tuple[float, float, float, int]) -> Any:
+    """Add a new non-leaf subtree to the end of <tree>.subtrees, whose value
+    is tree.value + list(elements), and whose weight, _max_leaf, _leaf_sum
+    and _leaf_count are <totals>. Return the tree that its subtrees are to
+    be added to.
+
+    <elements> is a string of one-character elements, or a tuple.
+
+    In a SimplePrefixTree, the new subtree is the first of a chain of
+    len(elements) trees, each the only subtree of the one before, and the
+    last of them is returned.
+    """
+    if isinstance(tree, SimplePrefixTree):
+        for element in elements:
+            subtree = tree._new_subtree()
+            subtree._value = _DERIVED
+            subtree._element = element
+            subtree._parent = tree
+            subtree.weight, subtree._max_leaf, subtree._leaf_sum, \
+                subtree._leaf_count = totals
+            tree._children[element] = subtree
+            tree.subtrees.append(subtree)
+            tree = subtree
+        return tree
+    subtree = tree._new_subtree()
+    if type(elements) is type(tree._key):
+        key = tree._key[:tree._length] + elements
+    else:
+        key = _pack_key(tree.value + list(elements))
+    subtree._set_prefix(key, tree._length + len(elements))
+    subtree.weight, subtree._max_leaf, subtree._leaf_sum, \
+        subtree._leaf_count = totals
+    tree._children[elements[0]] = subtree
+    tree.subtrees.append(subtree)
+    return subtree
+
+
+def _leaf_totals(first_child: List[int], weights: List[float]) -> \
+        Tuple[List[int], List[float]]:
+    """Return the number of leaves in each node of a CompiledAutocompleter,
+    and the sum of their weights, given its _first_child and _weights.
+    """
+    leaf_counts = [1] * len(weights)
+    leaf_sums = list(weights)
+    # Each child is numbered after its parent.
+    for node in reversed(range(len(weights))):
+        start, end = first_child[node], first_child[node + 1]
+        if start < end:
+            leaf_counts[node] = sum(leaf_counts[start:end])
+            leaf_sums[node] = sum(leaf_sums[start:end])
+    return leaf_counts, leaf_sums
+
+
+def _leaves(tree: Any) -> List[Any]:
+    """Return a list of the leaves of <tree>.
+    """
+    leaves = []
+    stack = [tree]
+    while stack:
+        subtree = stack.pop()
+        if subtree.subtrees == []:
+            if subtree.weight > 0:
+                leaves.append(subtree)
+        else:
+            stack.extend(subtree.subtrees)
+    return leaves
+
+
+@contextmanager
+def _gc_paused() -> Iterator[None]:
+    """Turn off the cyclic garbage collector for the duration of the with
+    statement.
+
+    Building a whole tree at once allocates millions of nodes, which would
+    otherwise set off many full collections that cannot free any of them.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def _aggregate_items(items: Iterable[Tuple[Any, float, List]]) -> \
+        List[Tuple[Any, float, List]]:
+    """Return one (value, weight, prefix) tuple for each distinct value in
+    <items>, whose weight is the total weight of that value in <items>,
+    sorted by prefix.
+    """
+    totals = {}
+    unhashable = []
+    for value, weight, prefix in items:
+        try:
+            if value in totals:
+                totals[value][1] += weight
+            else:
+                totals[value] = [value, float(weight), prefix]
+        except TypeError:
+            for entry in unhashable:
+                if entry[0] == value:
+                    entry[1] += weight
+                    break
+            else:
+                unhashable.append([value, float(weight), prefix])
+
+    entries = [tuple(entry) for entry in totals.values()]
+    entries.extend(tuple(entry) for entry in unhashable)
+    entries.sort(key=lambda entry: entry[2])
+    return entries
+
+
+def _pack_key(prefix: List) -> Sequence:
+    """Return a sequence with the same elements as <prefix>, stored compactly.
+
+    A prefix of one-character strings, such as the prefixes of the letter
+    engine, is packed into one string. Any other prefix becomes a tuple.
+    """
+    try:
+        packed = ''.join(prefix)
+    except TypeError:
+        return tuple(prefix)
+    if list(packed) == prefix:
+        return packed
+    return tuple(prefix)
+
+
+def _common_length(prefix1: List, prefix2: List, start: int = 0,
+                   end: Optional[int] = None) -> int:
+    """Return the length of the longest common prefix of <prefix1> and
+    prefix2[:end], or of <prefix1> and <prefix2> if <end> is None.
+
+    Precondition: the first <start> elements of <prefix1> and <prefix2> are
+    the same.
+    """
+    length = start
+    if end is None:
+        end = len(prefix2)
+    end = min(len(prefix1), end)
+    while length < end and prefix1[length] == prefix2[length]:
+        length += 1
+    return length
+
+
+def _finish_tree(tree: Any) -> None:
+    """Compute the aggregate weight and _max_leaf of non-leaf <tree> from
+    its subtrees, which are complete, and sort its subtrees by weight and by
+    _max_leaf.
+    """
+    if tree.subtrees == []:
+        return
+    tree._leaf_count = 0
+    tree._leaf_sum = 0.0
+    tree._max_leaf = 0.0
+    for subtree in tree.subtrees:
+        if subtree.subtrees == []:
+            tree._leaf_count += 1
+            tree._leaf_sum += subtree.weight
+        else:
+            tree._leaf_count += subtree._leaf_count
+            tree._leaf_sum += subtree._leaf_sum
+        if subtree._max_leaf > tree._max_leaf:
+            tree._max_leaf = subtree._max_leaf
+    tree.weight = tree._cal_weight()
+    _sort_subtrees(tree.subtrees, 'weight')
+    if len(tree.subtrees) > 1:
+        tree._by_max_leaf = list(tree.subtrees)
+        _sort_subtrees(tree._by_max_leaf, '_max_leaf')
+    else:
+        tree._by_max_leaf = None
+
+
+def _edge_label(tree: Any, parent_length: int) -> List:
+    """Return the elements of the value of non-leaf <tree> after the first
+    <parent_length>, which are those in its parent's value.
+    """
+    if isinstance(tree, SimplePrefixTree):
+        if tree._value is _DERIVED:
+            return [tree._element]
+        return tree.value[parent_length:]
+    return list(tree._key[parent_length:tree._length])
+
+
+def _str_indented(tree: Any, depth: int) -> str:
+    """Return an indented string representation of <tree>, starting at the
+    indentation level <depth>.
+    """
+    if tree.is_empty():
+        return ''
+    lines = []
+    stack = [(depth, tree)]
+    while stack:
+        depth, subtree = stack.pop()
+        lines.append('  ' * depth + f'{subtree.value} ({subtree.weight})\n')
+        for child in reversed(subtree.subtrees):
+            stack.append((depth + 1, child))
+    return ''.join(lines)
+
+
+def _index_leaf(leaf_index: Dict[Any, Any], leaf: Any) -> None:
+    """Record <leaf> in <leaf_index> under its value, if the value is
+    hashable.
+    """
+    try:
+        leaf_index[leaf.value] = leaf
+    except TypeError:
+        pass
+
+
+def _unindex_leaf(leaf_index: Dict[Any, Any], leaf: Any) -> None:
+    """Remove <leaf> from <leaf_index>, if its value is hashable.
+    """
+    try:
+        leaf_index.pop(leaf.value, None)
+    except TypeError:
+        pass
 
 
 if __name__ == '__main__':
@@ -0,0 +1,134 @@
+"""CSC148 Assignment 2: Text sanitization
+
+=== Module description ===
+This file contains the text sanitization of the letter and sentence engines:
+every letter is made lowercase, and every character that is not
+alphanumeric is removed, apart from the spaces and newlines that the letter
+engine keeps.
+
+A Sanitizer does this with translation tables built once, so that a whole
+file, or a whole line, is sanitized by str.translate and bytes.translate
+instead of one character at a time in Python. ASCII characters, which are
+nearly all of the bundled data, go through bytes.translate; the rare lines
+with other characters are then finished by str.translate.
+"""
+from __future__ import annotations
+from typing import Callable, Dict, List, Optional, Union
+
+
+class Sanitizer:
+    """A text sanitization, which makes every alphanumeric character
+    lowercase, and removes every other character unless it is kept.
+
+    === Attributes ===
+    keep:
+        Whether a character that is not alphanumeric is kept as it is.
+    """
+    keep: Callable[[str], bool]
+    # === Private Attributes ===
+    # _bytes_table and _bytes_delete are the arguments to bytes.translate
+    # that sanitize the ASCII characters of UTF-8 text, and leave every
+    # other byte as it is.
+    _bytes_table: bytes
+    _bytes_delete: bytes
+    # _table is the argument to str.translate that sanitizes any text. It
+    # maps each character it has seen so far, by code point, to its
+    # sanitized string, or to None if it is removed.
+    _table: _CharTable
+
+    def __init__(self, keep: Callable[[str], bool]) -> None:
+        """Initialize a sanitization that keeps each character that is not
+        alphanumeric if keep(character) is True.
+        """
+        self.keep = keep
+        self._table = _CharTable(keep)
+        ascii_table = [self._table[code] for code in range(128)]
+        self._bytes_table = bytes(
+            [ord(char) if char is not None else code
+             for code, char in enumerate(ascii_table)]
+            + list(range(128, 256)))
+        self._bytes_delete = bytes(code for code, char in enumerate(ascii_table)
+                                   if char is None)
+
+    def sanitize(self, text: Union[str, bytes]) -> str:
+        """Return <text>, a string or UTF-8 bytes, sanitized."""
+        if isinstance(text, str):
+            if text.isascii():
+                return text.translate(self._table)
+            text = text.encode('utf8')
+        sanitized = text.translate(self._bytes_table,
+                                   self._bytes_delete).decode('utf8')
+        if sanitized.isascii():
+            return sanitized
+        return sanitized.translate(self._table)
+
+    def sanitize_lines(self, text: Union[str, bytes]) -> List[str]:
+        """Return the lines of <text>, a string or UTF-8 bytes, sanitized.
+
+        The lines are separated by '\\n', which is removed, so
+        text.split('\\n') is the list of lines before sanitization.
+
+        Precondition: self.keep('\\n') is True
+        """
+        if isinstance(text, str):
+            text = text.encode('utf8')
+        lines = text.translate(self._bytes_table,
+                               self._bytes_delete).decode('utf8').split('\n')
+        table = self._table
+        return [line if line.isascii() else line.translate(table)
+                for line in lines]
+
+    def sanitize_words(self, word_list: List[str]) -> List[str]:
+        """Return a list of each word in <word_list>, sanitized, and with
+        any spaces in it removed.
+
+        Precondition: self.keep(' ') is True
+        """
+        # The words are sanitized together; splitting at ' ' keeps a word
+        # that is removed entirely as ''.
+        sanitized = self.sanitize(' '.join(word_list)).split(' ')
+        if len(sanitized) == len(word_list):
+            return sanitized
+        # Some word has a space in it, or there are no words.
+        return [self.sanitize(word).replace(' ', '') for word in word_list]
+
+
+class _CharTable(Dict[int, Optional[str]]):
+    """A translation table for str.translate, which maps the code point of
+    each character to its sanitized string, or to None if it is removed.
+
+    The table is filled in as str.translate looks up each character.
+    """
+    # === Private Attributes ===
+    # _keep is the keep attribute of the Sanitizer that uses this table.
+    _keep: Callable[[str], bool]
+
+    def __init__(self, keep: Callable[[str], bool]) -> None:
+        """Initialize an empty table for a Sanitizer that keeps each
+        character that is not alphanumeric if keep(character) is True.
+        """
+        dict.__init__(self)
+        self._keep = keep
+
+    def __missing__(self, code: int) -> Optional[str]:
+        """Add the sanitized string of the character with code point <code>
+        to this table, and return it.
+        """
+        char = chr(code)
+        if char.isalnum():
+            sanitized = char.lower()
+        elif self._keep(char):
+            sanitized = char
+        else:
+            sanitized = None
+        self[code] = sanitized
+        return sanitized
+
+
+# The sanitization of the letter engine, applied to whole files: spaces and
+# newlines are kept.
+LETTER_SANITIZER = Sanitizer(lambda char: char in ' \n')
+
+# The sanitization of the sentence engine, applied to the words of the
+# strings in its CSV file: spaces are kept only to separate the words.
+WORD_SANITIZER = Sanitizer(lambda char: char == ' ')